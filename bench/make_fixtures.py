@@ -0,0 +1,101 @@
+import gzip
+import math
+import os
+import random
+
+# Writes the synthetic captures benchmark.py replays, they are not recorded from ffmpeg. The metadata capture follows
+# the output of "ebur128=metadata=1,ametadata=mode=print" line for line (values with 3 decimals, pts_time formatted
+# with %.6g) for the channels of a 7.1 source split by _get_meter_graph, blocks of every channel interleaved as they
+# arrive from the pipe. The error burst is what stderr shows while an RTMP input drops packets. Both are seeded, so
+# every run writes the same files.
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SEED = 20240501
+SAMPLE_RATE = 48000
+BLOCK_SAMPLES = 4800  # asetnsamples of the meter graph, 100 ms per block
+SHORT_TERM_BLOCKS = 30
+GATE = -70
+FLOOR = -120.691
+
+
+def _format_pts_time(block):
+    return '{:.6g}'.format(block * BLOCK_SAMPLES / SAMPLE_RATE)
+
+
+def _get_channel_blocks(rng, blocks):
+    # [(M, S, I, LRA, LRA low, LRA high)] of one channel
+    level = rng.uniform(-32, -20)
+    momentary = []
+    result = []
+    for k in range(blocks):
+        level = min(-8, max(-60, level + rng.gauss(0, 0.8)))
+        # ebur128 reports its floor until the 400 ms and 3 s windows are filled
+        m = level + rng.gauss(0, 1.5) if k >= 3 else FLOOR
+        momentary.append(m)
+        if k >= SHORT_TERM_BLOCKS - 1:
+            window = momentary[-SHORT_TERM_BLOCKS:]
+            s = 10 * math.log10(sum(10 ** (v / 10) for v in window) / len(window))
+        else:
+            s = FLOOR
+        gated = sorted(v for v in momentary if v > GATE)
+        if gated:
+            i = 10 * math.log10(sum(10 ** (v / 10) for v in gated) / len(gated))
+            low, high = gated[len(gated) // 10], gated[len(gated) * 95 // 100]
+        else:
+            i, low, high = GATE, 0, 0
+        result.append((m, s, i, high - low, low, high))
+    return result
+
+
+def write_metadata(path, channels=8, blocks=240, input_id=1):
+    rng = random.Random(SEED)
+    per_channel = [_get_channel_blocks(rng, blocks) for _ in range(channels)]
+    lines = []
+    for k in range(blocks):
+        for ch in range(channels):
+            m, s, i, lra, low, high = per_channel[ch][k]
+            lines += [
+                'frame:{:<4d} pts:{:<7d} pts_time:{}'.format(k, k * BLOCK_SAMPLES, _format_pts_time(k)),
+                'lavfi.r128.M={:.3f}'.format(m),
+                'lavfi.r128.S={:.3f}'.format(s),
+                'lavfi.r128.I={:.3f}'.format(i),
+                'lavfi.r128.LRA={:.3f}'.format(lra),
+                'lavfi.r128.LRA.low={:.3f}'.format(low),
+                'lavfi.r128.LRA.high={:.3f}'.format(high),
+                'monitor.channel={}_{}'.format(input_id, ch),
+            ]
+    _write(path, lines)
+
+
+def write_error_burst(path, bursts=200):
+    # decoder errors of the damaged frames, the demuxer complaining about the stream and "Last message repeated"
+    # lines folding the rest
+    rng = random.Random(SEED)
+    lines = []
+    for k in range(bursts):
+        lines.append('[flv @ 0x55d5c8a3e4c0] Packet mismatch {} {} {}'.format(
+            rng.randrange(1, 1 << 20), rng.randrange(1, 1 << 16), rng.randrange(1, 1 << 16)
+        ))
+        for _ in range(rng.randrange(3, 12)):
+            mb_x, mb_y = rng.randrange(120), rng.randrange(68)
+            lines.append('[h264 @ 0x55d5c8b41a80] {}'.format(rng.choice([
+                'error while decoding MB {} {}, bytestream -{}'.format(mb_x, mb_y, rng.randrange(1, 64)),
+                'concealing {} DC, {} AC, {} MV errors in P frame'.format(*(rng.randrange(1, 8160) for _ in range(3))),
+                'left block unavailable for requested intra4x4 mode -1 at {} {}'.format(0, mb_y),
+                'cabac decode of qscale diff failed at {} {}'.format(mb_x, mb_y),
+            ])))
+        if rng.random() < 0.5:
+            lines.append('    Last message repeated {} times'.format(rng.randrange(1, 40)))
+        if k % 25 == 24:
+            lines.append('[rtmp @ 0x55d5c8a3f200] RTMP_ReadPacket, failed to read RTMP packet header')
+    _write(path, lines)
+
+
+def _write(path, lines):
+    with open(path, 'wb') as fout:
+        with gzip.GzipFile(fileobj=fout, mode='wb', mtime=0) as gz:
+            gz.write(('\n'.join(lines) + '\n').encode())
+
+
+if __name__ == '__main__':
+    write_metadata(os.path.join(FIXTURES_DIR, 'metadata_7.1.txt.gz'))
+    write_error_burst(os.path.join(FIXTURES_DIR, 'stderr_error_burst.txt.gz'))
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+import types
+from collections import deque
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench')
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+WORK_DIR = tempfile.mkdtemp(prefix='monitor.bench.')
+# streams of the source the synthetic captures stand for (see bench/make_fixtures.py), metadata_7.1 is its audio
+# stream #1
+FIXTURE_VIDEO_STREAM = {
+    'index': 0, 'codec_type': 'video', 'width': 1920, 'height': 1080, 'sample_aspect_ratio': '1:1',
+    'avg_frame_rate': '25/1',
+}
+CHANNEL_LAYOUTS = {1: 'mono', 2: 'stereo', 3: '2.1', 4: 'quad', 5: '5.0', 6: '5.1', 7: '6.1', 8: '7.1'}
+
+
+def _out_str_builder(i):
+    return 'rtmp://127.0.0.1:1935/bench/source{}'.format(i)
+
+
+class BenchConfiguration:
+    # everything the benchmarked code reads, nothing is executed or connected to and every file it writes or removes
+    # is in WORK_DIR, never those of a running monitor
+    BASE_DIR = WORK_DIR
+    STATIC_DIR = WORK_DIR
+    FFMPEG_PATH = 'ffmpeg'
+    FFMPEG_GLOBAL_ARGS = ['-hide_banner', '-nostats']
+    FFMPEG_OUT_STR_BUILDER = _out_str_builder
+    FFPROBE_PATH = 'ffprobe'
+    FFPROBE_ARGS = ['-hide_banner']
+    FFPROBE_TIMEOUT = 5
+    LAYOUT_MAP_WIDTH = 12
+    FFMPEG_OUT_ARGS = ['-f', 'flv', '-c:v', 'libx264', '-g', '25', '-preset', 'fast', '-c:a', 'aac', '-b:a', '128k']
+    LOG_DIR = WORK_DIR
+    EBUR_STATS_SHM_TPL = os.path.join(WORK_DIR, 'ebur.source{}')
+    EBUR_HISTORY_SHM_TPL = os.path.join(WORK_DIR, 'ebur.history.source{}')
+    ALARM_STATE_PATH = os.path.join(WORK_DIR, 'alarms.json')
+    THUMBNAIL_SHM_TPL = os.path.join(WORK_DIR, 'thumb.source{}.jpg')
+    LAYOUT_CACHE_PATH = os.path.join(WORK_DIR, 'layout.cache.json')
+    METRICS_PATH = None
+    # a fixed budget keeps the generated args independent of the host
+    CPU_BUDGET_CORES = list(range(8))
+
+
+try:
+    import config  # noqa: F401
+except ImportError:
+    # monitor.py imports the configuration, the benchmark never uses it
+    sys.modules['config'] = types.SimpleNamespace(AppConfiguration=BenchConfiguration)
+
+import monitor  # noqa: E402
+
+
+def _load_fixture(name):
+    with gzip.open(os.path.join(FIXTURES_DIR, name), 'rb') as fin:
+        return fin.read()
+
+
+def _get_app(layout_path=None, **conf):
+    return monitor.Application(
+        type('Configuration', (BenchConfiguration,), conf),
+        argparse.Namespace(verbosity=0, command='run', layout=layout_path, mosaic=False, shard=None, coordinator=None,
+                           node=None)
+    )
+
+
+def _get_audio_streams(channels):
+    # 8 channel streams and one stream for the rest, as a multichannel source would have them
+    streams = []
+    while channels > 0:
+        n = min(channels, 8)
+        streams.append({
+            'index': len(streams) + 1, 'codec_type': 'audio', 'channels': n, 'channel_layout': CHANNEL_LAYOUTS[n],
+            'sample_rate': '48000',
+        })
+        channels -= n
+    return streams
+
+
+def _get_frame(i, source, x=0, y=0):
+    return {
+        'name': 'frame {}'.format(i), 'x': x, 'y': y, 'width': 1, 'height': 1, 'source': source, 'video_height': 360,
+        'meter_channel_font': '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 'meter_channel_font_size': 10,
+    }
+
+
+def _measure(fn, repeat):
+    # best time of a call, calls are batched so that a measurement lasts at least 0.2 s
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def _measure_allocations(fn):
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'alloc_peak_bytes': peak - before, 'alloc_retained_bytes': current - before}
+
+
+class ReplayBench:
+    # Replays a capture through the supervisor's pipe readers, the same coroutines that read the pipes of a running
+    # ffmpeg process (with a real stats segment, history and alarm engine behind the metadata reader).
+    def __init__(self, channels):
+        app = _get_app()
+        app.layout = [_get_frame(0, 'rtmp://127.0.0.1:1935/live/cam1')]
+        processes = app._get_frame_processes({
+            'rtmp://127.0.0.1:1935/live/cam1': {'streams': [FIXTURE_VIDEO_STREAM] + _get_audio_streams(channels)},
+        })
+        app._plan_cpu_budget(processes)
+        self.log_sink = monitor.LogSink(1, 64 * 1024, 10 * 1024 * 1024, 1, 60)
+        self.log_sink.start()
+        self.supervisor = monitor.Supervisor(processes, self.log_sink, app.conf, lambda msg: None)
+        self.process = monitor.SupervisedProcess(processes[0], self.supervisor.alarms)
+        self.process.publisher.open()
+
+    def metadata(self, data):
+        asyncio.run(self._replay(lambda stream: self.supervisor._read_metadata(self.process, stream), data))
+
+    def stderr(self, data):
+        lines = deque(maxlen=5)
+        asyncio.run(self._replay(lambda stream: self.supervisor._read_stderr(self.process, stream, lines), data))
+
+    @staticmethod
+    async def _replay(reader, data):
+        stream = asyncio.StreamReader(limit=1024 * 1024)
+        stream.feed_data(data)
+        stream.feed_eof()
+        await reader(stream)
+
+    def close(self):
+        self.process.publisher.remove()
+        self.log_sink.close()
+
+
+def bench_replay(repeat):
+    results = []
+    bench = ReplayBench(8)
+    try:
+        for (name, fixture, replay) in (
+            ('replay_metadata', 'metadata_7.1.txt.gz', bench.metadata),
+            ('replay_stderr_errors', 'stderr_error_burst.txt.gz', bench.stderr),
+        ):
+            data = _load_fixture(fixture)
+            lines = data.count(b'\n')
+            seconds = _measure(lambda: replay(data), repeat)
+            result = {'name': name, 'params': {'fixture': fixture, 'lines': lines}, 'seconds': seconds,
+                      'lines_per_second': lines / seconds}
+            result.update(_measure_allocations(lambda: replay(data)))
+            results.append(result)
+    finally:
+        bench.close()
+    return results
+
+
+def bench_graphs(repeat, channel_counts):
+    results = []
+    app = _get_app()
+    source = 'rtmp://127.0.0.1:1935/live/cam1'
+    app.layout = [_get_frame(0, source)]
+    for channels in channel_counts:
+        streams = _get_audio_streams(channels)
+        seconds = _measure(lambda: app._get_meter_graph(streams, app.layout[0]['meter_channel_font'], 10), repeat)
+        results.append({'name': 'meter_graph', 'params': {'channels': channels}, 'seconds': seconds})
+        sources_info = {source: {'streams': [FIXTURE_VIDEO_STREAM] + streams}}
+
+        def _build():
+            # what _cmd_run builds once the sources are probed
+            app._plan_cpu_budget(app._get_frame_processes(sources_info))
+
+        seconds = _measure(_build, repeat)
+        results.append({'name': 'run_filtergraph', 'params': {'channels': channels}, 'seconds': seconds})
+    return results
+
+
+def bench_layouts(repeat, frame_counts):
+    results = []
+    for frames in frame_counts:
+        width = max(1, int(frames ** 0.5))
+        layout = [_get_frame(i, 'rtmp://127.0.0.1:1935/live/cam{}'.format(i % 50), i % width, i // width)
+                  for i in range(frames)]
+        layout_path = os.path.join(WORK_DIR, 'layout.{}.json'.format(frames))
+        cache_path = os.path.join(WORK_DIR, 'layout.{}.cache.json'.format(frames))
+        with open(layout_path, 'w') as fout:
+            json.dump(layout, fout)
+        for (name, layout_cache_path) in (('layout_check', None), ('layout_check_cached', cache_path)):
+
+            def _check():
+                _get_app(layout_path, LAYOUT_MAP_WIDTH=width, LAYOUT_CACHE_PATH=layout_cache_path)._layout_check()
+
+            _check()
+            seconds = _measure(_check, repeat)
+            results.append({'name': name, 'params': {'frames': frames}, 'seconds': seconds})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the monitor control plane, no ffmpeg or network '
+                                                 'needed. Results are written as JSON.')
+    parser.add_argument('-o', '--output', help='output file (stdout by default)')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='measurements per benchmark, the best one counts')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes, for a smoke run')
+    args = parser.parse_args()
+    started = time.time()
+    channel_counts = (1, 8) if args.quick else (1, 2, 8, 16, 32, 64)
+    frame_counts = (100,) if args.quick else (100, 1000, 10000)
+    try:
+        results = bench_replay(args.repeat) + bench_graphs(args.repeat, channel_counts) + \
+            bench_layouts(args.repeat, frame_counts)
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+    report = {
+        'monitor_version': monitor.VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': started,
+        'repeat': args.repeat,
+        'results': results,
+    }
+    encoded = json.dumps(report, indent=2)
+    if args.output is None:
+        sys.stdout.write(encoded + '\n')
+    else:
+        with open(args.output, 'w') as fout:
+            fout.write(encoded + '\n')
@@ -0,0 +1,480 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import signal
+import time
+
+CLUSTER_PROTOCOL_VERSION = 1
+DEFAULT_CLUSTER_PORT = 8765
+CLUSTER_MESSAGE_LIMIT = 16 * 1024 * 1024
+
+
+def partition_groups(costs, capacities, current=None, rebalance=True):
+    # Assigns every group of frames ({group: cost}) to a node ({node: capacity}) so that cost / capacity is balanced,
+    # returns {group: node}. Groups keep their current node while it is listed, the others go largest first to the
+    # least loaded node, then (if rebalance) the largest group whose move lowers the load of the most loaded node is
+    # moved off it, for as long as there is one. Equal inputs give equal results, ties are broken by group and node
+    # order.
+    if not capacities:
+        return {}
+    current = current or {}
+    nodes = sorted(capacities)
+    loads = {node: 0 for node in nodes}
+    assignment = {}
+    ordered = sorted(costs, key=lambda g: (-costs[g], g))
+    for g in ordered:
+        if current.get(g) in loads:
+            assignment[g] = current[g]
+            loads[current[g]] += costs[g]
+    for g in ordered:
+        if g not in assignment:
+            node = min(nodes, key=lambda n: ((loads[n] + costs[g]) / capacities[n], n))
+            assignment[g] = node
+            loads[node] += costs[g]
+    for _ in range(len(ordered) if rebalance else 0):
+        src = max(nodes, key=lambda n: (loads[n] / capacities[n], n))
+        dst = min(nodes, key=lambda n: (loads[n] / capacities[n], n))
+        peak = loads[src] / capacities[src]
+        movable = [
+            g for g in ordered if assignment[g] == src and costs[g] > 0 and
+            max((loads[src] - costs[g]) / capacities[src], (loads[dst] + costs[g]) / capacities[dst]) < peak
+        ]
+        if not movable:
+            break
+        assignment[movable[0]] = dst
+        loads[src] -= costs[movable[0]]
+        loads[dst] += costs[movable[0]]
+    return assignment
+
+
+def parse_address(value):
+    # "host:port" or ":port" (all interfaces)
+    host, _, port = value.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError('"{}" is not a host:port address.'.format(value))
+    if not 0 < port < 65536:
+        raise argparse.ArgumentTypeError('"{}" is not a host:port address.'.format(value))
+    return host.strip('[]') or None, port
+
+
+def parse_shard(value):
+    # "k/n", the k-th of n shards (1-based)
+    try:
+        k, n = map(int, value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('"{}" is not a k/n shard spec.'.format(value))
+    if not 1 <= k <= n:
+        raise argparse.ArgumentTypeError('"{}" is not a k/n shard spec.'.format(value))
+    return k, n
+
+
+class ClusterWorker:
+    # Runs the frames a coordinator assigns to this node: the coordinator sends the compiled layout and the frame ids
+    # to run, the worker reports its processes, EBUR stats and alarms every CLUSTER_REPORT_INTERVAL and the
+    # coordinator acknowledges every report with the current assignment. A worker that hears nothing for half of
+    # CLUSTER_WORKER_TIMEOUT stops its frames, well before the coordinator hands them over to other nodes (see
+    # Coordinator), so that none runs twice, and keeps reconnecting.
+    def __init__(self, conf, log, address, node, capacity, assign):
+        self.conf = conf
+        self._log = log
+        self.host, self.port = address
+        self.node = node
+        self.capacity = capacity
+        self._assign = assign  # called with (layout, [frame id]) before the supervisor is asked to reload
+        self.layout = None
+        self.layout_version = None
+        self.frames = []
+        self._last_contact = None
+
+    async def run(self, supervisor):
+        fence = asyncio.ensure_future(self._fence(supervisor))
+        try:
+            await self._connect(supervisor)
+        finally:
+            fence.cancel()
+
+    async def _connect(self, supervisor):
+        delay = self.conf.SUPERVISOR_BACKOFF_MIN
+        while True:
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(
+                    self.host or 'localhost', self.port, limit=CLUSTER_MESSAGE_LIMIT
+                ), self.conf.CLUSTER_WORKER_TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as e:
+                self._log('Coordinator {}:{} is not reachable: {}.'.format(
+                    self.host or 'localhost', self.port, str(e) or type(e).__name__
+                ))
+            else:
+                self._log('Connected to coordinator {}:{} as "{}".'.format(
+                    self.host or 'localhost', self.port, self.node
+                ))
+                delay = self.conf.SUPERVISOR_BACKOFF_MIN
+                try:
+                    await self._session(supervisor, reader, writer)
+                except (OSError, ValueError, asyncio.TimeoutError) as e:
+                    self._log('Coordinator connection lost: {}.'.format(str(e) or type(e).__name__))
+                finally:
+                    writer.close()
+            await asyncio.sleep(delay)
+            delay = min(self.conf.SUPERVISOR_BACKOFF_MAX, delay * 2)
+
+    async def _fence(self, supervisor):
+        # connected or not, the frames stop once the coordinator has been silent for half of CLUSTER_WORKER_TIMEOUT
+        loop = asyncio.get_running_loop()
+        timeout = self.conf.CLUSTER_WORKER_TIMEOUT / 2
+        while True:
+            await asyncio.sleep(min(self.conf.CLUSTER_REPORT_INTERVAL, timeout / 2))
+            if self.frames and loop.time() - self._last_contact >= timeout:
+                self._log('No word from the coordinator for {:g} s - stopping the assigned frames.'.format(timeout))
+                self._update(supervisor, self.layout, self.layout_version, [])
+
+    async def _session(self, supervisor, reader, writer):
+        loop = asyncio.get_running_loop()
+        _send_message(writer, {
+            'type': 'hello', 'version': CLUSTER_PROTOCOL_VERSION, 'node': self.node, 'capacity': self.capacity,
+            'layout_version': self.layout_version, 'frames': self._get_running_frames(supervisor),
+        })
+        reporter = asyncio.ensure_future(self._report(supervisor, writer))
+        try:
+            while True:
+                msg = await _receive_message(reader, self.conf.CLUSTER_WORKER_TIMEOUT)
+                if msg is None:
+                    raise ConnectionError('closed by the coordinator')
+                self._last_contact = loop.time()
+                if msg.get('type') == 'error':
+                    raise ValueError('refused by the coordinator: {}'.format(msg.get('error')))
+                if msg.get('type') != 'assign':
+                    continue
+                if 'layout' in msg:
+                    layout, version = msg['layout'], msg['layout_version']
+                else:
+                    layout, version = self.layout, self.layout_version
+                frames = sorted(map(int, msg['frames']))
+                if version != self.layout_version or frames != self.frames:
+                    self._update(supervisor, layout, version, frames)
+        finally:
+            reporter.cancel()
+
+    def _update(self, supervisor, layout, version, frames):
+        self._log('Assigned frame(s): {}.'.format(', '.join(map(str, frames)) or 'none'))
+        self.layout = layout
+        self.layout_version = version
+        self.frames = frames
+        self._assign(layout, frames)
+        supervisor.request_reload()
+
+    async def _report(self, supervisor, writer):
+        while True:
+            _send_message(writer, self._get_report(supervisor))
+            await asyncio.sleep(self.conf.CLUSTER_REPORT_INTERVAL)
+
+    @staticmethod
+    def _get_running_frames(supervisor):
+        # every frame with a process, whatever its state, a frame is free for other nodes once its process is gone
+        return sorted(f['id'] for p in supervisor.processes.values() for f in p.publisher.frames)
+
+    def _get_report(self, supervisor):
+        processes = []
+        stats = []
+        for p in supervisor.processes.values():
+            processes.append({
+                'name': p.name, 'state': p.state, 'restarts': p.restarts,
+                'frames': [f['id'] for f in p.publisher.frames],
+            })
+            for (frame_id, records) in p.publisher.latest():
+                stats.append({'frame': frame_id, 'channels': [{
+                    'id': r[0], 'time': r[1], 'M': self._finite(r[2]), 'S': self._finite(r[3]),
+                    'I': self._finite(r[4]), 'LRA': self._finite(r[5]),
+                } if r is not None else None for r in records]})
+        return {
+            'type': 'report', 'layout_version': self.layout_version, 'frames': self._get_running_frames(supervisor),
+            'processes': processes, 'stats': stats,
+            'alarms': supervisor.alarms.active() if supervisor.alarms is not None else [],
+        }
+
+    @staticmethod
+    def _finite(v):
+        return v if math.isfinite(v) else None
+
+
+class Coordinator:
+    # Splits the layout's frames between the worker nodes connected to it by estimated cost (see partition_groups,
+    # frames sharing a source go together) and merges what the workers report into a single view written to
+    # CLUSTER_STATE_PATH. A frame is granted to a node only once no other node reports it any more, so it never runs
+    # twice while it moves. A node leaving (closing the connection or staying silent for CLUSTER_WORKER_TIMEOUT) keeps
+    # its frames for CLUSTER_WORKER_TIMEOUT + SUPERVISOR_STOP_TIMEOUT: the worker has stopped them by then (see
+    # ClusterWorker) unless it came back, and then it just goes on running them. Frames without a node are placed
+    # right away, frames are moved between running nodes to balance the load only once the nodes and the plan have
+    # not changed for CLUSTER_REBALANCE_DELAY, so a flapping node restarts nothing. The plan is rebuilt whenever the
+    # layout file changes.
+    def __init__(self, conf, log, warning, address, plan, reload=None, watch_path=None):
+        self.conf = conf
+        self._log = log
+        self._warning = warning
+        self.host, self.port = address
+        self._reload = reload  # returns a new plan or None to keep the current one, called in a worker thread
+        self._watch_path = watch_path
+        self.layout = None
+        self.layout_version = None
+        self.groups = {}  # group -> [frame id]
+        self.costs = {}  # group -> cost
+        self.nodes = {}  # name -> node
+        self.fenced = {}  # name of a node that left -> (frame ids it ran, timer handing its groups over)
+        self.assignment = {}  # group -> node name
+        self._rebalance_timer = None
+        self._stop = None
+        self._handlers = set()  # connection handling tasks
+        self._set_plan(*plan)
+
+    def run(self):
+        asyncio.run(self._main())
+
+    def stop(self):
+        self._stop.set()
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                signal.signal(sig, lambda *_: loop.call_soon_threadsafe(self.stop))
+        server = await asyncio.start_server(self._handle, self.host, self.port, limit=CLUSTER_MESSAGE_LIMIT)
+        self._log('Coordinator listening on {}.'.format(', '.join(
+            '{}:{}'.format(*s.getsockname()[:2]) for s in server.sockets
+        )))
+        background = [asyncio.ensure_future(self._state_writer())]
+        if self._reload is not None and self._watch_path is not None and self.conf.LAYOUT_WATCH_INTERVAL:
+            background.append(asyncio.ensure_future(self._watch()))
+        await self._stop.wait()
+        server.close()
+        for task in background:
+            task.cancel()
+        # the handlers close their connections, asyncio.run would otherwise cancel them only after the loop stopped
+        for task in self._handlers:
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        if self._rebalance_timer is not None:
+            self._rebalance_timer.cancel()
+        if self.conf.CLUSTER_STATE_PATH is not None:
+            try:
+                os.remove(self.conf.CLUSTER_STATE_PATH)
+            except FileNotFoundError:
+                pass
+
+    def _set_plan(self, layout, groups, costs):
+        self.layout = layout
+        self.layout_version = hashlib.sha256(json.dumps(layout, sort_keys=True).encode()).hexdigest()[:16]
+        self.groups = groups
+        self.costs = costs
+        self._rebalance()
+
+    def _rebalance(self, full=False):
+        # the groups of nodes that left stay theirs until handed over (see _hand_over)
+        pinned = {g: name for (g, name) in self.assignment.items() if name in self.fenced and g in self.costs}
+        capacities = {name: node['capacity'] for (name, node) in self.nodes.items()}
+        assignment = partition_groups(
+            {g: cost for (g, cost) in self.costs.items() if g not in pinned}, capacities, self.assignment,
+            rebalance=full
+        )
+        assignment.update(pinned)
+        moved = sum(
+            len(self.groups[g]) for (g, name) in assignment.items()
+            if self.assignment.get(g) is not None and self.assignment[g] != name
+        )
+        self.assignment = assignment
+        if moved and self.nodes:
+            self._log('Frames rebalanced over {} node(s), {} frame(s) moved.'.format(len(self.nodes), moved))
+        if self._rebalance_timer is not None:
+            self._rebalance_timer.cancel()
+            self._rebalance_timer = None
+        if not full and self.nodes:
+            self._rebalance_timer = asyncio.get_running_loop().call_later(
+                self.conf.CLUSTER_REBALANCE_DELAY, self._rebalance, True
+            )
+        for node in self.nodes.values():
+            self._send_assignment(node)
+
+    def _hand_over(self, name):
+        del self.fenced[name]
+        self._log('Worker "{}" did not come back - moving its frames.'.format(name))
+        self._rebalance()
+
+    def _send_assignment(self, node, force=False):
+        # whole groups only, and only those none of whose frames still runs on another node
+        held_elsewhere = set()
+        for other in self.nodes.values():
+            if other is not node:
+                held_elsewhere |= other['held']
+        for (held, _) in self.fenced.values():
+            held_elsewhere |= held
+        frames = sorted(
+            i for (g, name) in self.assignment.items()
+            if name == node['name'] and held_elsewhere.isdisjoint(self.groups[g]) for i in self.groups[g]
+        )
+        if not force and frames == node['granted'] and node['layout_version'] == self.layout_version:
+            return
+        msg = {'type': 'assign', 'layout_version': self.layout_version, 'frames': frames}
+        if node['layout_version'] != self.layout_version:
+            msg['layout'] = self.layout
+            node['layout_version'] = self.layout_version
+        node['granted'] = frames
+        _send_message(node['writer'], msg)
+
+    async def _handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        peer = '{}:{}'.format(*peer[:2]) if peer else '?'
+        node = None
+        self._handlers.add(asyncio.current_task())
+        try:
+            hello = await _receive_message(reader, self.conf.CLUSTER_WORKER_TIMEOUT)
+            if hello is None:
+                return
+            if hello.get('type') != 'hello' or hello.get('version') != CLUSTER_PROTOCOL_VERSION:
+                raise ValueError('not a protocol version {} hello'.format(CLUSTER_PROTOCOL_VERSION))
+            name = str(hello['node'])
+            capacity = float(hello['capacity'])
+            if not 0 < capacity < float('inf'):
+                raise ValueError('invalid capacity')
+            if name in self.nodes:
+                _send_message(writer, {'type': 'error', 'error': 'node "{}" is already connected'.format(name)})
+                return
+            if name in self.fenced:
+                # back within the grace period, the node's frames are still its own
+                self.fenced.pop(name)[1].cancel()
+            now = time.time()
+            node = {
+                'name': name, 'address': peer, 'capacity': capacity, 'writer': writer, 'joined': now,
+                'last_report': now, 'held': set(map(int, hello['frames'])), 'granted': None,
+                'layout_version': hello.get('layout_version'), 'processes': [], 'stats': [], 'alarms': [],
+            }
+            self.nodes[name] = node
+            self._log('Worker "{}" joined from {} ({:g} CPU(s)).'.format(name, peer, capacity))
+            if node['layout_version'] == self.layout_version:
+                # frames a node still runs from before (after a coordinator restart) stay where they are
+                for (g, frame_ids) in self.groups.items():
+                    if self.assignment.get(g) not in self.nodes and node['held'].issuperset(frame_ids):
+                        self.assignment[g] = name
+            self._rebalance()
+            while True:
+                msg = await _receive_message(reader, self.conf.CLUSTER_WORKER_TIMEOUT)
+                if msg is None:
+                    break
+                if msg.get('type') != 'report':
+                    continue
+                released = node['held'] - set(map(int, msg['frames']))
+                node.update({
+                    'held': set(map(int, msg['frames'])), 'processes': msg['processes'], 'stats': msg['stats'],
+                    'alarms': msg['alarms'], 'last_report': time.time(),
+                })
+                self._send_assignment(node, force=True)
+                if released:
+                    for other in self.nodes.values():
+                        if other is not node:
+                            self._send_assignment(other)
+        except (OSError, ValueError, KeyError, TypeError, asyncio.TimeoutError) as e:
+            self._warning('Worker {} ({}): {}.'.format(
+                '"{}"'.format(node['name']) if node is not None else '?', peer, str(e) or type(e).__name__
+            ))
+        except asyncio.CancelledError:
+            # the coordinator is stopping, the streams callback would report a cancelled handler as an error
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+            if node is not None and self.nodes.get(node['name']) is node and not self._stop.is_set():
+                del self.nodes[node['name']]
+                if node['held'] or node['name'] in self.assignment.values():
+                    grace = self.conf.CLUSTER_WORKER_TIMEOUT + self.conf.SUPERVISOR_STOP_TIMEOUT
+                    self.fenced[node['name']] = (node['held'], asyncio.get_running_loop().call_later(
+                        grace, self._hand_over, node['name']
+                    ))
+                    self._log('Worker "{}" left, its frames move to other nodes in {:g} s unless it comes back.'.format(
+                        node['name'], grace
+                    ))
+                else:
+                    self._log('Worker "{}" left.'.format(node['name']))
+                self._rebalance()
+
+    async def _watch(self):
+        loop = asyncio.get_running_loop()
+        last = self._stat_watch_path()
+        while True:
+            await asyncio.sleep(self.conf.LAYOUT_WATCH_INTERVAL)
+            current = self._stat_watch_path()
+            if current == last:
+                continue
+            last = current
+            self._log('Reloading layout...')
+            plan = await loop.run_in_executor(None, self._reload)
+            if plan is not None:
+                self._set_plan(*plan)
+                self._log('Layout reloaded ({}).'.format(self.layout_version))
+
+    def _stat_watch_path(self):
+        try:
+            st = os.stat(self._watch_path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    async def _state_writer(self):
+        while True:
+            if self.conf.CLUSTER_STATE_PATH is not None:
+                self._write_state(self._get_state())
+            await asyncio.sleep(self.conf.CLUSTER_REPORT_INTERVAL)
+
+    def _get_state(self):
+        # the whole wall as one document: nodes with their load and health, every frame with its node and stats
+        assigned = {i: name for (g, name) in self.assignment.items() for i in self.groups[g]}
+        running = {i: name for (name, (held, _)) in self.fenced.items() for i in held}
+        running.update({i: node['name'] for node in self.nodes.values() for i in node['held']})
+        stats = {s['frame']: s['channels'] for node in self.nodes.values() for s in node['stats']}
+        nodes = []
+        for node in self.nodes.values():
+            cost = sum(self.costs[g] for (g, name) in self.assignment.items() if name == node['name'])
+            nodes.append({
+                'name': node['name'], 'address': node['address'], 'capacity': node['capacity'], 'cost': cost,
+                'load': cost / node['capacity'], 'frames': sorted(node['held']),
+                'assigned': sorted(i for (i, name) in assigned.items() if name == node['name']),
+                'joined': node['joined'], 'last_report': node['last_report'], 'processes': node['processes'],
+            })
+        return {
+            'time': time.time(),
+            'layout_version': self.layout_version,
+            'nodes': nodes,
+            'frames': [{
+                'id': i, 'name': f['name'], 'node': assigned.get(i), 'running_on': running.get(i),
+                'channels': stats.get(i),
+            } for (i, f) in enumerate(self.layout['frames'])],
+            'alarms': [dict(a, node=node['name']) for node in self.nodes.values() for a in node['alarms']],
+        }
+
+    def _write_state(self, state):
+        tmp_path = '{}.tmp'.format(self.conf.CLUSTER_STATE_PATH)
+        with open(tmp_path, 'w') as fout:
+            json.dump(state, fout)
+        os.replace(tmp_path, self.conf.CLUSTER_STATE_PATH)
+
+
+def _send_message(writer, msg):
+    # messages are JSON objects, one per line
+    if not writer.is_closing():
+        writer.write(json.dumps(msg, separators=(',', ':')).encode() + b'\n')
+
+
+async def _receive_message(reader, timeout):
+    # returns the next message or None at EOF, raises ValueError on anything but a JSON object
+    line = await asyncio.wait_for(reader.readline(), timeout)
+    if not line:
+        return None
+    msg = json.loads(line)
+    if type(msg) != dict:
+        raise ValueError('not a message')
+    return msg
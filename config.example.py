@@ -8,15 +8,69 @@ def out_str_builder(i):
 class AppConfiguration:
     BASE_DIR = os.path.realpath(os.path.dirname(__file__))
     STATIC_DIR = os.path.join(BASE_DIR, 'static')
-    FFMPEG_PATH = r'D:\ffmpeg-20160307-git-6f5048f-win64-static\bin\ffmpeg.exe'
+    STATIC_MAX_AGE = 24 * 3600
+    WEB_HOST = 'localhost'
+    WEB_PORT = 8080
+    WEB_DEBUG = False
+    FFMPEG_PATH = r'D:\ffmpeg-7.1-full_build\bin\ffmpeg.exe'
     FFMPEG_GLOBAL_ARGS = ['-hide_banner', '-nostats', ]
     FFMPEG_OUT_STR_BUILDER = out_str_builder
-    FFPROBE_PATH = r'D:\ffmpeg-20160307-git-6f5048f-win64-static\bin\ffprobe.exe'
+    FFPROBE_PATH = r'D:\ffmpeg-7.1-full_build\bin\ffprobe.exe'
     FFPROBE_ARGS = ['-hide_banner']
     FFPROBE_TIMEOUT = 5
+    PROBE_WORKERS = 8
+    PROBE_CACHE_PATH = r'D:\Temp\monitor.probe.json'
+    PROBE_CACHE_TTL = 3600
+    PROBE_RETRY_INTERVAL = 30
     LAYOUT_MAP_WIDTH = 12
+    LAYOUT_CACHE_PATH = r'D:\Temp\monitor.layout.json'
+    LAYOUT_WATCH_INTERVAL = 2
+    CAPABILITY_CACHE_PATH = r'D:\Temp\monitor.capabilities.json'
+    MOSAIC_CELL_WIDTH = 480
+    MOSAIC_CELL_HEIGHT = 270
+    MOSAIC_OUT_STR = 'rtmp://127.0.0.1:1935/cams/mosaic'
+    EBUR_STATS_SHM_TPL = r'D:\Temp\ebur.source{}.shm'
     EBUR_STATS_FILENAME_TPL = 'D:\Temp\ebur.source{}.stats'
+    EBUR_HISTORY_SHM_TPL = r'D:\Temp\ebur.history.source{}.shm'
+    EBUR_HISTORY_TIERS = [[0.1, 6000], [1, 3600], [60, 1440]]
+    ALARM_RULES = [
+        {'name': 'silence', 'metric': 'S', 'below': -60, 'clear': -55, 'for': 10},
+        {'name': 'over-level', 'metric': 'M', 'above': -10, 'clear': -12, 'for': 1},
+        {'name': 'channel loss', 'metric': 'age', 'above': 5},
+    ]
+    ALARM_INTERVAL = 0.5
+    ALARM_STATE_PATH = r'D:\Temp\monitor.alarms.json'
+    METRICS_PATH = r'D:\Temp\monitor.metrics.json'
+    METRICS_INTERVAL = 5
+    # thumbnails are read from FIFOs (os.mkfifo), which Windows lacks: set a path template like
+    # '/dev/shm/monitor.thumb.source{}.jpg' on Linux or macOS to enable them
+    THUMBNAIL_SHM_TPL = None
+    THUMBNAIL_INTERVAL = 5
+    THUMBNAIL_HEIGHT = 180
+    THUMBNAIL_QUALITY = 5
+    CLUSTER_REPORT_INTERVAL = 1
+    CLUSTER_WORKER_TIMEOUT = 5
+    CLUSTER_REBALANCE_DELAY = 30
+    CLUSTER_STATE_PATH = r'D:\Temp\monitor.cluster.json'
+    CPU_BUDGET = True
+    CPU_BUDGET_CORES = None
+    CPU_CORE_PIXEL_RATE = 25000000
     FFMPEG_OUT_ARGS = ['-f', 'flv',
                        '-c:v', 'libx264', '-g', '25', '-preset', 'fast',
                        '-c:a', 'aac', '-b:a', '128k']
     LOG_DIR = r'D:\Temp'
+    LOG_FLUSH_INTERVAL = 1
+    LOG_FLUSH_SIZE = 64 * 1024
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT = 5
+    LOG_REPEAT_WINDOW = 60
+    SUPERVISOR_BACKOFF_MIN = 1
+    SUPERVISOR_BACKOFF_MAX = 60
+    SUPERVISOR_STABLE_TIME = 30
+    SUPERVISOR_DEGRADED_TIMEOUT = 5
+    SUPERVISOR_HUNG_TIMEOUT = 30
+    SUPERVISOR_STOP_TIMEOUT = 5
+    SUPERVISOR_MAX_RESTARTS = 0
+    SUPERVISOR_LAUNCH_RATE = 10
+    SUPERVISOR_LAUNCH_BURST = 5
+    SUPERVISOR_MAX_STARTING = 10
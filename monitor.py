@@ -1,18 +1,155 @@
 import argparse
+import array
+import asyncio
+import bisect
+import hashlib
+import heapq
 import json
 import os
 import subprocess
 import sys
 import math
+import mmap
+import queue
+import random
+import signal
+import socket
+import struct
+import tempfile
 import threading
 import datetime
-import re
+import time
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+from cluster import DEFAULT_CLUSTER_PORT, ClusterWorker, Coordinator, parse_address, parse_shard, partition_groups
 from config import AppConfiguration
 
 VERSION = "dev"
-EBUR_RE = re.compile(r'\[Parsed_ebur128_.+M:\s*(?P<m>\S+)\s+S:\s*(?P<s>\S+)\s+I:\s*(?P<i>\S+).+LRA:\s*(?P<lra>\S+)')
+EBUR_CHANNEL_TAG = 'monitor.channel'
+LAYOUT_COMPILER_VERSION = 1
+LAYOUT_CACHE_ENTRIES = 16
+LAYOUT_MAP_PRINT_CELLS = 4096
+CAPABILITY_CACHE_ENTRIES = 16
+CAPABILITY_MANIFEST_VERSION = 2
+# ffmpeg filters the generated filtergraphs use
+REQUIRED_FILTERS = (
+    'ametadata', 'anull', 'anullsink', 'anullsrc', 'asetnsamples', 'channelsplit', 'color', 'crop', 'drawtext',
+    'ebur128', 'fps', 'overlay', 'pad', 'scale', 'setsar', 'split',
+)
+# filter: (options the generated filtergraphs set, ffmpeg release that has them all)
+REQUIRED_FILTER_OPTIONS = {
+    'ametadata': (('mode', 'key', 'value', 'file', 'direct'), '4.1'),
+    'ebur128': (('metadata',), '2.0'),
+}
+THUMBNAIL_FIFO_SUFFIX = '.fifo'
+# the alarm state is rewritten at least this often (seconds) even without changes, web.py takes older files of other
+# nodes for ones left behind by a node that is gone
+ALARM_STATE_REFRESH_INTERVAL = 5
+THUMBNAIL_MAX_BYTES = 4 * 1024 * 1024
+# history timestamps follow the pts of the EBUR metadata unless it drifts this far (seconds) from the wall clock
+EBUR_PTS_MAX_DRIFT = 5
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+DEFAULT_FRAME_RATE = 25
+# decoding a pixel costs a fraction of scaling, overlaying and encoding one
+SOURCE_DECODE_WEIGHT = 0.25
+# metering and drawing one audio channel costs about as much as rendering as many pixels (see _get_frame_groups),
+# sources that can not be probed count as stereo
+METER_CHANNEL_PIXELS = 50000
+DEFAULT_SOURCE_CHANNELS = 2
+# x264 presets from the slowest one, with their rough encoding speed relative to "medium"
+X264_PRESET_SPEEDS = (
+    ('veryslow', 0.2), ('slower', 0.4), ('slow', 0.7), ('medium', 1), ('fast', 1.3), ('faster', 1.7),
+    ('veryfast', 2.5), ('superfast', 4), ('ultrafast', 6),
+)
+# name: (type, help, histogram buckets)
+METRICS_HELP = {
+    'monitor_ffmpeg_up': ('gauge', 'Whether the ffmpeg process is running.', None),
+    'monitor_ffmpeg_state': ('gauge', 'Supervisor state of the ffmpeg process (1 for the current one).', None),
+    'monitor_ffmpeg_restarts_total': ('counter', 'Restarts of the ffmpeg process.', None),
+    'monitor_ffmpeg_uptime_seconds': ('gauge', 'Seconds since the ffmpeg process was started.', None),
+    'monitor_ffmpeg_stderr_lines_total': ('counter', 'Lines the ffmpeg process wrote to stderr.', None),
+    'monitor_ffmpeg_cpu_seconds_total': ('counter', 'CPU time of the ffmpeg process (from /proc).', None),
+    'monitor_ffmpeg_resident_memory_bytes': ('gauge', 'Resident memory of the ffmpeg process (from /proc).', None),
+    'monitor_ebur_parse_seconds': (
+        'histogram', 'Time spent parsing an EBUR metadata line.', (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 1e-3)
+    ),
+    'monitor_ebur_updates_total': ('counter', 'EBUR stats updates (one per channel and measurement) of a frame.', None),
+    'monitor_ebur_staleness_seconds': ('gauge', 'Seconds since the last EBUR stats update of a frame.', None),
+    'monitor_probe_duration_seconds': (
+        'histogram', 'ffprobe run time per source.', (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    ),
+    'monitor_probe_failures_total': ('counter', 'Sources ffprobe failed to fetch info from.', None),
+    'monitor_metrics_age_seconds': ('gauge', 'Seconds since the supervisor wrote the metrics snapshot.', None),
+}
+# parameter: (allowed types, default value)
+OPTIONAL_PARAMETERS = {
+    'PROBE_WORKERS': ((int,), 8),
+    'PROBE_CACHE_PATH': ((str, type(None)), None),
+    'PROBE_CACHE_TTL': ((int,), 3600),
+    'PROBE_RETRY_INTERVAL': ((int, float), 30),  # seconds between probes of the sources skipped as unreachable, 0 never
+    'LAYOUT_CACHE_PATH': ((str, type(None)), os.path.join(SHM_DIR, 'monitor.layout.json')),
+    'CAPABILITY_CACHE_PATH': ((str, type(None)), None),
+    'LAYOUT_WATCH_INTERVAL': ((int, float), 2),
+    'EBUR_STATS_SHM_TPL': ((str,), os.path.join(SHM_DIR, 'monitor.ebur.source{}')),
+    'EBUR_STATS_FILENAME_TPL': ((str, type(None)), None),
+    'EBUR_HISTORY_SHM_TPL': ((str, type(None)), os.path.join(SHM_DIR, 'monitor.ebur.history.source{}')),
+    # [[resolution (seconds), capacity (buckets)], ...], 10 min at 100 ms, 1 h at 1 s, 24 h at 1 min by default
+    'EBUR_HISTORY_TIERS': ((list,), [[0.1, 6000], [1, 3600], [60, 1440]]),
+    # see AlarmEngine, metric is one of M, S, I, LRA or age (seconds since the channel last reported)
+    'ALARM_RULES': ((list,), [
+        {'name': 'silence', 'metric': 'S', 'below': -60, 'clear': -55, 'for': 10},
+        {'name': 'over-level', 'metric': 'M', 'above': -10, 'clear': -12, 'for': 1},
+        {'name': 'channel loss', 'metric': 'age', 'above': 5},
+    ]),
+    'ALARM_INTERVAL': ((int, float), 0.5),
+    'ALARM_STATE_PATH': ((str, type(None)), os.path.join(SHM_DIR, 'monitor.alarms.json')),
+    'METRICS_PATH': ((str, type(None)), os.path.join(SHM_DIR, 'monitor.metrics.json')),
+    'METRICS_INTERVAL': ((int, float), 5),
+    # a JPEG snapshot of every frame's output every THUMBNAIL_INTERVAL seconds, None to disable
+    'THUMBNAIL_SHM_TPL': ((str, type(None)), os.path.join(SHM_DIR, 'monitor.thumb.source{}.jpg')),
+    'THUMBNAIL_INTERVAL': ((int, float), 5),
+    'THUMBNAIL_HEIGHT': ((int,), 180),
+    'THUMBNAIL_QUALITY': ((int,), 5),  # mjpeg -q:v, 2 (best) to 31
+    'CPU_BUDGET': ((bool,), True),
+    'CPU_BUDGET_CORES': ((list, type(None)), None),  # CPUs to run ffmpeg on, all the monitor may use by default
+    'CPU_CORE_PIXEL_RATE': ((int, float), 25000000),  # pixels per second one CPU renders with the configured preset
+    # see cluster.Coordinator and cluster.ClusterWorker
+    'CLUSTER_REPORT_INTERVAL': ((int, float), 1),
+    'CLUSTER_WORKER_TIMEOUT': ((int, float), 5),
+    'CLUSTER_REBALANCE_DELAY': ((int, float), 30),
+    'CLUSTER_STATE_PATH': ((str, type(None)), os.path.join(SHM_DIR, 'monitor.cluster.json')),
+    'WEB_HOST': ((str,), 'localhost'),
+    'WEB_PORT': ((int,), 8080),
+    'WEB_DEBUG': ((bool,), False),  # bottle debug mode, static files are then read from disk on every request
+    'STATIC_MAX_AGE': ((int,), 24 * 3600),  # seconds, browsers revalidate with the ETag afterwards
+    'LOG_FLUSH_INTERVAL': ((int, float), 1),
+    'LOG_FLUSH_SIZE': ((int,), 64 * 1024),
+    'LOG_MAX_BYTES': ((int,), 10 * 1024 * 1024),
+    'LOG_BACKUP_COUNT': ((int,), 5),
+    'LOG_REPEAT_WINDOW': ((int, float), 60),
+    'MOSAIC_CELL_WIDTH': ((int,), 480),
+    'MOSAIC_CELL_HEIGHT': ((int,), 270),
+    'MOSAIC_OUT_STR': ((str, type(None)), None),
+    'SUPERVISOR_BACKOFF_MIN': ((int, float), 1),
+    'SUPERVISOR_BACKOFF_MAX': ((int, float), 60),
+    'SUPERVISOR_STABLE_TIME': ((int, float), 30),
+    'SUPERVISOR_DEGRADED_TIMEOUT': ((int, float), 5),
+    'SUPERVISOR_HUNG_TIMEOUT': ((int, float), 30),  # a process without EBUR metadata for as long is restarted, 0 never
+    'SUPERVISOR_STOP_TIMEOUT': ((int, float), 5),
+    'SUPERVISOR_MAX_RESTARTS': ((int,), 0),
+    # (re)starts are admitted at LAUNCH_RATE per second after a burst of LAUNCH_BURST, with at most MAX_STARTING
+    # processes connecting (not yet delivering EBUR metadata) at once, 0 for no limit
+    'SUPERVISOR_LAUNCH_RATE': ((int, float), 10),
+    'SUPERVISOR_LAUNCH_BURST': ((int,), 5),
+    'SUPERVISOR_MAX_STARTING': ((int,), 10),
+}
+
+
+def apply_conf_defaults(conf):
+    for (p, (_, default)) in OPTIONAL_PARAMETERS.items():
+        if not hasattr(conf, p):
+            setattr(conf, p, default)
 
 
 class ConfException(Exception):
@@ -27,55 +164,1383 @@ class FrameInputException(Exception):
     pass
 
 
-def _ffmpeg_thread(exec_args, log_path, ebur_stats_path, audio_ch_ids):
+class FileCache:
+    # JSON file backed key -> {'time': stored timestamp, 'value': value} store, entries older than ttl seconds
+    # (if set) are ignored and only the newest max_entries (if set) are saved
+    def __init__(self, path, ttl=None, max_entries=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        if path is not None:
+            try:
+                with open(path) as fin:
+                    entries = json.load(fin)
+            except (OSError, ValueError):
+                entries = {}
+            if type(entries) == dict:
+                self._entries = {k: v for (k, v) in entries.items()
+                                 if type(v) == dict and 'time' in v and 'value' in v}
 
-        deque_size = 5
+    def _expired(self, entry, now):
+        return self.ttl is not None and now - entry['time'] > self.ttl
 
-        def _write_log(s):
-            with open(log_path, 'a') as fout:
-                fout.write("{}: {}\n".format(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), s))
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or self._expired(entry, time.time()):
+            return None
+        return entry['value']
 
-        def _write_ebur_stats(stats):
-            with open(ebur_stats_path, 'w') as fout:
-                for s in stats:
-                    fout.write('{}\n'.format(s))
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = {'time': time.time(), 'value': value}
 
-        while True:
-            _write_log('Starting ffmpeg process {}'.format(' '.join(exec_args)))
-            last_lines_log = deque(maxlen=deque_size)
-            ebur_stats_disabled = False
-            proc = subprocess.Popen(exec_args, stderr=subprocess.PIPE, universal_newlines=True)
-            _write_log('ffmpeg process started')
-            audio_ch_count = len(audio_ch_ids)
-            gathered_ebur_stats = []
-            current_ch = 0
-            passed_summary = False
-            for line in proc.stderr:
-                last_lines_log.append(line)
-                if not ebur_stats_disabled:
-                    if line.startswith('[Parsed_ebur128_'):
-                        if not passed_summary and line.find('Summary') != -1:
-                            continue
-                        m = EBUR_RE.match(line)
-                        if m is not None:
-                            passed_summary = True
-                            gathered_ebur_stats.append('{} {}'.format(audio_ch_ids[current_ch], ' '.join(m.groups())))
-                            current_ch += 1
-                        else:
-                            try:
-                                os.remove(ebur_stats_path)
-                            except FileNotFoundError:
-                                pass
-                            _write_log('<WARNING> EBUR stats parsing error - disabling.')
-                            ebur_stats_disabled = True
-                        if current_ch == audio_ch_count:
-                            _write_ebur_stats(gathered_ebur_stats)
-                            gathered_ebur_stats = []
-                            current_ch = 0
-            proc.wait()
-            _write_log(
-                'ffmpeg process stopped (code {}). Output:\n"{}".'.format(proc.returncode, '\n'.join(last_lines_log))
+    def remove(self, key):
+        # returns the removed value, None if there was none (or it had expired)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None or self._expired(entry, time.time()):
+            return None
+        return entry['value']
+
+    def save(self):
+        if self.path is None:
+            return
+        now = time.time()
+        with self._lock:
+            entries = sorted(
+                ((k, v) for (k, v) in self._entries.items() if not self._expired(v, now)), key=lambda e: e[1]['time']
             )
+        if self.max_entries is not None:
+            entries = entries[-self.max_entries:]
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as fout:
+            json.dump(dict(entries), fout)
+        os.replace(tmp_path, self.path)
+
+
+class EburStatsSegment:
+    # Memory-mapped EBU R128 stats of a single source: a header followed by one fixed-size record per channel.
+    # Every record carries its own sequence counter which is odd while the record is being written, so readers
+    # retry instead of seeing a half-updated record. A restarted writer replaces the file and marks the old mapping
+    # as dead, readers then have to reopen the segment.
+    MAGIC = b'EBUR'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIII')  # magic, version, channel count, live flag
+    CHANNEL_ID = struct.Struct('<16s')
+    SEQ = struct.Struct('<Q')
+    VALUES = struct.Struct('<ddddd')  # timestamp, M, S, I, LRA
+    RECORD_SIZE = CHANNEL_ID.size + SEQ.size + VALUES.size
+    READ_ATTEMPTS = 1000
+
+    def __init__(self, path, buf, channel_ids, writable):
+        self.path = path
+        self.channel_ids = channel_ids
+        self._buf = buf
+        self._writable = writable
+
+    @classmethod
+    def create(cls, path, channel_ids):
+        size = cls.HEADER.size + cls.RECORD_SIZE * len(channel_ids)
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w+b') as f:
+            f.truncate(size)
+            buf = mmap.mmap(f.fileno(), size)
+        cls.HEADER.pack_into(buf, 0, cls.MAGIC, cls.VERSION, len(channel_ids), 1)
+        for (ch, ch_id) in enumerate(channel_ids):
+            offset = cls.HEADER.size + ch * cls.RECORD_SIZE
+            cls.CHANNEL_ID.pack_into(buf, offset, ch_id.encode())
+            cls.VALUES.pack_into(buf, offset + cls.CHANNEL_ID.size + cls.SEQ.size, *([float('nan')] * 5))
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # e.g. a reader still maps the old segment on Windows, the next start tries again
+            buf.close()
+            raise
+        return cls(path, buf, list(channel_ids), True)
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, count, _ = cls.HEADER.unpack_from(buf, 0)
+            if magic != cls.MAGIC or version != cls.VERSION or len(buf) != cls.HEADER.size + cls.RECORD_SIZE * count:
+                raise ValueError('"{}" is not a valid EBUR stats segment.'.format(path))
+        except (ValueError, struct.error):
+            buf.close()
+            raise ValueError('"{}" is not a valid EBUR stats segment.'.format(path))
+        channel_ids = [
+            cls.CHANNEL_ID.unpack_from(buf, cls.HEADER.size + ch * cls.RECORD_SIZE)[0].rstrip(b'\0').decode()
+            for ch in range(count)
+        ]
+        return cls(path, buf, channel_ids, False)
+
+    @property
+    def live(self):
+        return not self._buf.closed and self.HEADER.unpack_from(self._buf, 0)[3] == 1
+
+    def update(self, ch, m, s, i, lra):
+        offset = self.HEADER.size + ch * self.RECORD_SIZE + self.CHANNEL_ID.size
+        seq = self.SEQ.unpack_from(self._buf, offset)[0]
+        self.SEQ.pack_into(self._buf, offset, seq + 1)
+        self.VALUES.pack_into(self._buf, offset + self.SEQ.size, time.time(), m, s, i, lra)
+        self.SEQ.pack_into(self._buf, offset, seq + 2)
+
+    def read(self, ch):
+        # returns (seq, timestamp, M, S, I, LRA) or None if the record is stuck mid-write (writer died)
+        offset = self.HEADER.size + ch * self.RECORD_SIZE + self.CHANNEL_ID.size
+        for _ in range(self.READ_ATTEMPTS):
+            seq = self.SEQ.unpack_from(self._buf, offset)[0]
+            if seq % 2:
+                time.sleep(0)
+                continue
+            values = self.VALUES.unpack_from(self._buf, offset + self.SEQ.size)
+            if self.SEQ.unpack_from(self._buf, offset)[0] == seq:
+                return (seq,) + values
+        return None
+
+    def snapshot(self):
+        return [self.read(ch) for ch in range(len(self.channel_ids))]
+
+    def close(self):
+        if self._buf.closed:
+            return
+        if self._writable:
+            self.HEADER.pack_into(self._buf, 0, self.MAGIC, self.VERSION, len(self.channel_ids), 0)
+        self._buf.close()
+
+
+class LoudnessHistory:
+    # Memory-mapped loudness history of a single source. Every channel has one ring of fixed-size buckets per tier
+    # (resolution in seconds, capacity in buckets); samples are rolled up into every tier as they arrive, so a query
+    # reads the buckets of a single tier instead of the raw samples. A bucket keeps the mean and maximum momentary
+    # loudness, the mean short-term loudness and the last integrated loudness and loudness range.
+    # Rings are guarded by a sequence counter like EburStatsSegment records. The header names the source and frame
+    # the history belongs to (a JSON object padded to 8 bytes follows it). A writer reopens an existing file of the
+    # same source, frame, channels and tiers in place, so the history survives process restarts and layout reloads,
+    # and recreates any other file: frame indices of a reloaded layout may point to other sources.
+    MAGIC = b'EBHI'
+    VERSION = 2
+    HEADER = struct.Struct('<4sIIIII')  # magic, version, channel count, tier count, live flag, identity size
+    TIER = struct.Struct('<dQ')  # resolution, capacity
+    CHANNEL_ID = struct.Struct('<16s')
+    RING = struct.Struct('<QQ')  # seq, buckets written
+    FIELDS = ('M', 'M_max', 'S', 'I', 'LRA')
+    READ_ATTEMPTS = 1000
+
+    def __init__(self, path, buf, channel_ids, tiers, identity, writable):
+        self.path = path
+        self.channel_ids = channel_ids
+        self.tiers = tiers
+        self.identity = identity  # {'source': source URL, 'frame': frame name}
+        self._buf = buf
+        self._writable = writable
+        self._views = []
+        self._rings = []  # [channel][tier] -> (ring offset, bucket numbers view, values view)
+        self._identity_size = len(self._encode_identity(identity))
+        offset = self._tiers_offset(self._identity_size) + self.TIER.size * len(tiers) + \
+            self.CHANNEL_ID.size * len(channel_ids)
+        view = memoryview(buf)
+        self._views.append(view)
+        for _ in channel_ids:
+            rings = []
+            for (_, capacity) in tiers:
+                buckets = view[offset + self.RING.size:offset + self.RING.size + 8 * capacity].cast('q')
+                values_offset = offset + self.RING.size + 8 * capacity
+                values = view[values_offset:values_offset + 4 * len(self.FIELDS) * capacity].cast('f')
+                self._views += [buckets, values]
+                rings.append((offset, buckets, values))
+                offset += self._ring_size(capacity)
+            self._rings.append(rings)
+        # [channel][tier] -> [bucket number, M sum, M max, S sum, samples, I, LRA] of the bucket being filled
+        self._pending = [[None] * len(tiers) for _ in channel_ids]
+
+    @classmethod
+    def _ring_size(cls, capacity):
+        return cls.RING.size + 8 * capacity + (4 * len(cls.FIELDS) * capacity + 7) // 8 * 8
+
+    @staticmethod
+    def _encode_identity(identity):
+        return json.dumps(identity, sort_keys=True, separators=(',', ':')).encode()
+
+    @classmethod
+    def _tiers_offset(cls, identity_size):
+        return cls.HEADER.size + (identity_size + 7) // 8 * 8
+
+    @classmethod
+    def _size(cls, channel_ids, tiers, identity_size):
+        return cls._tiers_offset(identity_size) + cls.TIER.size * len(tiers) + \
+            cls.CHANNEL_ID.size * len(channel_ids) + \
+            len(channel_ids) * sum(cls._ring_size(capacity) for (_, capacity) in tiers)
+
+    @classmethod
+    def _parse(cls, path, buf):
+        # returns (channel ids, tiers, identity) of a valid history file
+        try:
+            magic, version, count, tier_count, _, identity_size = cls.HEADER.unpack_from(buf, 0)
+            if magic != cls.MAGIC or version != cls.VERSION:
+                raise ValueError
+            identity = json.loads(buf[cls.HEADER.size:cls.HEADER.size + identity_size].decode())
+            offset = cls._tiers_offset(identity_size)
+            tiers = [cls.TIER.unpack_from(buf, offset + k * cls.TIER.size) for k in range(tier_count)]
+            offset += cls.TIER.size * tier_count
+            channel_ids = [
+                cls.CHANNEL_ID.unpack_from(buf, offset + ch * cls.CHANNEL_ID.size)[0].rstrip(b'\0').decode()
+                for ch in range(count)
+            ]
+            if type(identity) != dict or len(buf) != cls._size(channel_ids, tiers, identity_size):
+                raise ValueError
+        except (ValueError, struct.error):
+            raise ValueError('"{}" is not a valid loudness history file.'.format(path))
+        return channel_ids, tiers, identity
+
+    @classmethod
+    def create(cls, path, channel_ids, tiers, identity):
+        tiers = [(float(resolution), int(capacity)) for (resolution, capacity) in tiers]
+        encoded = cls._encode_identity(identity)
+        try:
+            with open(path, 'r+b') as f:
+                buf = mmap.mmap(f.fileno(), 0)
+        except (OSError, ValueError):
+            buf = None
+        if buf is not None:
+            try:
+                if cls._parse(path, buf) == (list(channel_ids), tiers, identity):
+                    cls.HEADER.pack_into(
+                        buf, 0, cls.MAGIC, cls.VERSION, len(channel_ids), len(tiers), 1, len(encoded)
+                    )
+                    return cls(path, buf, list(channel_ids), tiers, identity, True)
+            except ValueError:
+                pass
+            buf.close()
+        size = cls._size(channel_ids, tiers, len(encoded))
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w+b') as f:
+            f.truncate(size)
+            buf = mmap.mmap(f.fileno(), size)
+        cls.HEADER.pack_into(buf, 0, cls.MAGIC, cls.VERSION, len(channel_ids), len(tiers), 1, len(encoded))
+        buf[cls.HEADER.size:cls.HEADER.size + len(encoded)] = encoded
+        offset = cls._tiers_offset(len(encoded))
+        for (k, tier) in enumerate(tiers):
+            cls.TIER.pack_into(buf, offset + k * cls.TIER.size, *tier)
+        offset += cls.TIER.size * len(tiers)
+        for (ch, ch_id) in enumerate(channel_ids):
+            cls.CHANNEL_ID.pack_into(buf, offset + ch * cls.CHANNEL_ID.size, ch_id.encode())
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            buf.close()
+            raise
+        return cls(path, buf, list(channel_ids), tiers, identity, True)
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            channel_ids, tiers, identity = cls._parse(path, buf)
+        except ValueError:
+            buf.close()
+            raise
+        return cls(path, buf, channel_ids, tiers, identity, False)
+
+    @property
+    def live(self):
+        return not self._buf.closed and self.HEADER.unpack_from(self._buf, 0)[4] == 1
+
+    def add(self, ch, timestamp, m, s, i, lra):
+        for (k, (resolution, _)) in enumerate(self.tiers):
+            bucket = int(timestamp // resolution)
+            pending = self._pending[ch][k]
+            if pending is not None and pending[0] != bucket:
+                self._write(ch, k, pending)
+                pending = None
+            if pending is None:
+                self._pending[ch][k] = [bucket, m, m, s, 1, i, lra]
+            else:
+                pending[1] += m
+                pending[2] = max(pending[2], m)
+                pending[3] += s
+                pending[4] += 1
+                pending[5] = i
+                pending[6] = lra
+
+    def _write(self, ch, k, pending):
+        offset, buckets, values = self._rings[ch][k]
+        seq, written = self.RING.unpack_from(self._buf, offset)
+        self.RING.pack_into(self._buf, offset, seq + 1, written)
+        bucket, m_sum, m_max, s_sum, samples, i, lra = pending
+        slot = written % len(buckets)
+        buckets[slot] = bucket
+        base = slot * len(self.FIELDS)
+        values[base] = m_sum / samples
+        values[base + 1] = m_max
+        values[base + 2] = s_sum / samples
+        values[base + 3] = i
+        values[base + 4] = lra
+        self.RING.pack_into(self._buf, offset, seq + 2, written + 1)
+
+    def flush(self):
+        # writes the buckets still being filled, a later sample of the same bucket is written as a second copy
+        for (ch, pending) in enumerate(self._pending):
+            for (k, p) in enumerate(pending):
+                if p is not None:
+                    self._write(ch, k, p)
+                    pending[k] = None
+
+    def _read_ring(self, ch, k, count):
+        # returns the last count (bucket number, [values]) of a ring or None if the ring is stuck mid-write
+        offset, buckets, values = self._rings[ch][k]
+        capacity = len(buckets)
+        width = len(self.FIELDS)
+        for _ in range(self.READ_ATTEMPTS):
+            seq, written = self.RING.unpack_from(self._buf, offset)
+            if seq % 2:
+                time.sleep(0)
+                continue
+            n = min(count, written, capacity)
+            first = (written - n) % capacity
+            if first + n <= capacity:
+                numbers = buckets[first:first + n].tolist()
+                flat = values[first * width:(first + n) * width].tolist()
+            else:
+                numbers = buckets[first:].tolist() + buckets[:first + n - capacity].tolist()
+                flat = values[first * width:].tolist() + values[:(first + n - capacity) * width].tolist()
+            if self.RING.unpack_from(self._buf, offset)[0] == seq:
+                return [(numbers[j], flat[j * width:(j + 1) * width]) for j in range(n)]
+        return None
+
+    def query(self, ch, seconds, resolution=None, now=None):
+        # Returns {'resolution': ..., 't': [bucket start times], 'M': [...], 'M_max': [...], ...} covering the last
+        # seconds at the requested resolution (the finest one covering the period if not given), or None if the
+        # ring is stuck mid-write. The coarsest tier not coarser than the resolution is read and, if needed, its
+        # buckets are merged further.
+        if now is None:
+            now = time.time()
+        usable = [k for (k, (res, _)) in enumerate(self.tiers) if resolution is None or res <= resolution]
+        if not usable:
+            usable = [min(range(len(self.tiers)), key=lambda k: self.tiers[k][0])]
+        covering = [k for k in usable if self.tiers[k][0] * self.tiers[k][1] >= seconds]
+        if resolution is None:
+            k = min(covering, key=lambda k: self.tiers[k][0]) if covering else \
+                max(usable, key=lambda k: self.tiers[k][0])
+        else:
+            k = max(covering or usable, key=lambda k: self.tiers[k][0])
+        tier_resolution = self.tiers[k][0]
+        if resolution is None or resolution < tier_resolution:
+            resolution = tier_resolution
+        buckets = self._read_ring(ch, k, math.ceil(seconds / tier_resolution) + 1)
+        if buckets is None:
+            return None
+        result = {'resolution': resolution, 't': []}
+        for field in self.FIELDS:
+            result[field] = []
+        start = now - seconds
+        merged = None  # [group number, M sum, M max, S sum, buckets, I, LRA]
+        for (j, (number, values)) in enumerate(buckets):
+            if number * tier_resolution < start or (j + 1 < len(buckets) and buckets[j + 1][0] == number):
+                # out of the period or written again later (see flush)
+                continue
+            # by the middle of the bucket, its start may fall a rounding error short of the group
+            group = int((number + 0.5) * tier_resolution // resolution)
+            if merged is not None and merged[0] != group:
+                self._append_merged(result, merged, resolution)
+                merged = None
+            m, m_max, s, i, lra = values
+            if merged is None:
+                merged = [group, m, m_max, s, 1, i, lra]
+            else:
+                merged[1] += m
+                merged[2] = max(merged[2], m_max)
+                merged[3] += s
+                merged[4] += 1
+                merged[5] = i
+                merged[6] = lra
+        if merged is not None:
+            self._append_merged(result, merged, resolution)
+        return result
+
+    @staticmethod
+    def _append_merged(result, merged, resolution):
+        group, m_sum, m_max, s_sum, count, i, lra = merged
+        result['t'].append(group * resolution)
+        result['M'].append(m_sum / count)
+        result['M_max'].append(m_max)
+        result['S'].append(s_sum / count)
+        result['I'].append(i)
+        result['LRA'].append(lra)
+
+    def close(self):
+        if self._buf.closed:
+            return
+        if self._writable:
+            self.flush()
+            self.HEADER.pack_into(
+                self._buf, 0, self.MAGIC, self.VERSION, len(self.channel_ids), len(self.tiers), 0, self._identity_size
+            )
+        for view in reversed(self._views):
+            view.release()
+        self._buf.close()
+
+
+class Metrics:
+    # Counters, gauges and histograms of the running monitor keyed by (name, labels), see METRICS_HELP. The
+    # supervisor writes a snapshot to METRICS_PATH which web.py renders in the Prometheus text format.
+    def __init__(self):
+        self._values = {}  # (name, labels) -> value or histogram [counts per bucket, sum, count]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, labels, value=1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, labels, value):
+        with self._lock:
+            self._values[self._key(name, labels)] = value
+
+    def observe(self, name, labels, value):
+        key = self._key(name, labels)
+        buckets = METRICS_HELP[name][2]
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = [[0] * (len(buckets) + 1), 0, 0]
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def remove(self, labels):
+        # drops every value with all of the labels, e.g. of a process gone after a layout reload
+        labels = set(labels.items())
+        with self._lock:
+            for key in [key for key in self._values if labels <= set(key[1])]:
+                del self._values[key]
+
+    def snapshot(self):
+        # [{'name', 'labels', 'value'}], the value of a histogram is {'counts', 'sum', 'count'}
+        with self._lock:
+            values = list(self._values.items())
+        snapshot = []
+        for ((name, labels), value) in values:
+            if type(value) == list:
+                value = {'counts': list(value[0]), 'sum': value[1], 'count': value[2]}
+            snapshot.append({'name': name, 'labels': dict(labels), 'value': value})
+        return snapshot
+
+
+class LogSink:
+    # Single background writer for all per-source logs. Source threads only enqueue messages; the sink thread writes
+    # them in batches (every flush_interval seconds or flush_size bytes, whichever comes first), rotates files by
+    # size and drops a message that was already written to the same log within repeat_window seconds, reporting
+    # the number of dropped copies once the window expires.
+    _STOP = object()
+
+    def __init__(self, flush_interval, flush_size, max_bytes, backup_count, repeat_window):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.repeat_window = repeat_window
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='log-sink', daemon=True)
+        self._pending = {}  # path -> [lines]
+        self._pending_size = 0
+        self._recent = {}  # (path, message) -> [last written time, dropped copies]
+        self._sizes = {}  # path -> current file size
+
+    def start(self):
+        self._thread.start()
+
+    def write(self, path, msg):
+        self._queue.put((path, time.time(), msg))
+
+    def close(self):
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        last_flush = time.time()
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0, last_flush + self.flush_interval - time.time()))
+            except queue.Empty:
+                item = None
+            if item is self._STOP:
+                self._expire_recent(None)
+                self._flush()
+                return
+            if item is not None:
+                self._add(*item)
+            now = time.time()
+            if self._pending_size >= self.flush_size or now - last_flush >= self.flush_interval:
+                self._expire_recent(now)
+                self._flush()
+                last_flush = now
+
+    def _add(self, path, timestamp, msg):
+        key = (path, msg)
+        recent = self._recent.get(key)
+        if recent is not None and timestamp - recent[0] < self.repeat_window:
+            recent[1] += 1
+            return
+        if recent is not None and recent[1]:
+            msg = '{} (repeated {} more time(s) since {})'.format(msg, recent[1], self._format_time(recent[0]))
+        self._recent[key] = [timestamp, 0]
+        self._append(path, timestamp, msg)
+
+    def _expire_recent(self, now):
+        for (key, (written, dropped)) in list(self._recent.items()):
+            if now is None or now - written >= self.repeat_window:
+                del self._recent[key]
+                if dropped:
+                    path, msg = key
+                    self._append(path, time.time(), 'Previous message repeated {} more time(s) since {}: {}'.format(
+                        dropped, self._format_time(written), msg
+                    ))
+
+    def _append(self, path, timestamp, msg):
+        line = '{}: {}\n'.format(self._format_time(timestamp), msg)
+        self._pending.setdefault(path, []).append(line)
+        self._pending_size += len(line)
+
+    @staticmethod
+    def _format_time(timestamp):
+        return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+    def _flush(self):
+        for (path, lines) in self._pending.items():
+            data = ''.join(lines)
+            try:
+                size = self._sizes.get(path)
+                if size is None:
+                    size = os.path.getsize(path) if os.path.isfile(path) else 0
+                if size and size + len(data) > self.max_bytes:
+                    self._rotate(path)
+                    size = 0
+                with open(path, 'a') as fout:
+                    fout.write(data)
+                self._sizes[path] = size + len(data)
+            except OSError as e:
+                self._sizes.pop(path, None)
+                sys.stderr.write('<WARNING> Failed to write log "{}": {}\n'.format(path, str(e)))
+        self._pending = {}
+        self._pending_size = 0
+
+    def _rotate(self, path):
+        if self.backup_count <= 0:
+            os.remove(path)
+            return
+        for n in range(self.backup_count - 1, 0, -1):
+            if os.path.isfile('{}.{}'.format(path, n)):
+                os.replace('{}.{}'.format(path, n), '{}.{}'.format(path, n + 1))
+        os.replace(path, '{}.1'.format(path))
+
+
+class EburMetadataParser:
+    # Incremental parser of "ametadata=mode=print" output. Every block starts with a "frame:" line (with the pts_time
+    # of the audio frame) followed by "key=value" lines; a block is complete once its channel tag and all four
+    # loudness values have been seen.
+    KEYS = {'lavfi.r128.M': 0, 'lavfi.r128.S': 1, 'lavfi.r128.I': 2, 'lavfi.r128.LRA': 3}
+
+    def __init__(self, channel_tags):
+        # channel_tags: "<prefix><channel id>" of every channel, as tagged by _get_meter_graph
+        self._channels = {tag.replace(':', '_'): ch for (ch, tag) in enumerate(channel_tags)}
+        self._ch = None
+        self._values = None
+        self._pts_time = None
+
+    def feed(self, line):
+        # returns (channel index, [M, S, I, LRA], pts_time or None) when a block is complete, None otherwise
+        if line.startswith('frame:'):
+            self._ch = None
+            self._values = [None] * 4
+            try:
+                self._pts_time = float(line.rpartition('pts_time:')[2])
+            except ValueError:
+                self._pts_time = None
+            return None
+        if self._values is None:
+            return None
+        key, sep, value = line.rstrip('\n').partition('=')
+        if not sep:
+            return None
+        if key == EBUR_CHANNEL_TAG:
+            self._ch = self._channels.get(value)
+            if self._ch is None:
+                self._values = None
+                raise ValueError('unknown channel tag "{}"'.format(value))
+        else:
+            pos = self.KEYS.get(key)
+            if pos is None:
+                return None
+            try:
+                self._values[pos] = float(value)
+            except ValueError:
+                self._values = None
+                raise ValueError('bad "{}" value "{}"'.format(key, value))
+        if self._ch is not None and None not in self._values:
+            result = (self._ch, self._values, self._pts_time)
+            self._values = None
+            return result
+        return None
+
+
+class AlarmEngine:
+    # Evaluates alarm rules over every metered channel at once. Channel values live in columns (one array per
+    # metric, one slot per frame channel) that are updated as EBUR metadata is parsed, and every tick walks each rule
+    # over whole columns, so its cost depends on the number of channels only and not on how they are spread over the
+    # processes. A rule is raised once its condition held for "for" seconds and cleared once the value stayed on the
+    # other side of "clear" (the threshold by default) for as long, which keeps values near a threshold from flapping.
+    METRICS = ('M', 'S', 'I', 'LRA', 'age')  # age: seconds since the channel last reported
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._slots = {}  # (frame id, channel id) -> slot
+        self._keys = []  # slot -> (frame id, channel id) or None if free
+        self._free = []
+        self._columns = [array.array('d') for _ in self.METRICS[:4]]
+        self._last = array.array('d')  # time of the last report
+        self._matches = [bytearray() for _ in rules]  # rule applies to the slot
+        self._raised = [bytearray() for _ in rules]
+        self._pending = [array.array('d') for _ in rules]  # time the slot started to change state, nan if it is not
+        self._changed = [array.array('d') for _ in rules]  # time of the last state change
+
+    @staticmethod
+    def _rule_matches(rule, frame_id, ch_id):
+        return ('frames' not in rule or frame_id in rule['frames']) and \
+            ('channels' not in rule or ch_id in rule['channels'])
+
+    def add(self, frame_id, ch_id, now):
+        key = (frame_id, ch_id)
+        slot = self._slots.get(key)
+        if slot is not None:
+            return slot
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+        else:
+            slot = len(self._keys)
+            self._keys.append(key)
+            for column in self._columns + [self._last] + self._pending + self._changed:
+                column.append(0)
+            for column in self._matches + self._raised:
+                column.append(0)
+        self._slots[key] = slot
+        for column in self._columns:
+            column[slot] = math.nan
+        self._last[slot] = now
+        for (r, rule) in enumerate(self.rules):
+            self._matches[r][slot] = self._rule_matches(rule, frame_id, ch_id)
+            self._raised[r][slot] = 0
+            self._pending[r][slot] = math.nan
+            self._changed[r][slot] = now
+        return slot
+
+    def discard(self, slot):
+        # alarms of a discarded channel disappear without being cleared
+        self._slots.pop(self._keys[slot], None)
+        self._keys[slot] = None
+        for r in range(len(self.rules)):
+            self._matches[r][slot] = 0
+            self._raised[r][slot] = 0
+            self._pending[r][slot] = math.nan
+        self._free.append(slot)
+
+    def update(self, slot, now, values):
+        for (column, v) in zip(self._columns, values):
+            column[slot] = v
+        self._last[slot] = now
+
+    def evaluate(self, now):
+        # returns [(frame id, channel id, rule name, raised, value)] of the state changes
+        changes = []
+        ages = [now - t for t in self._last]
+        for (r, rule) in enumerate(self.rules):
+            column = ages if rule['metric'] == 'age' else self._columns[self.METRICS.index(rule['metric'])]
+            threshold = rule['above'] if 'above' in rule else rule['below']
+            clear = rule.get('clear', threshold)
+            raised = self._raised[r]
+            pending = self._pending[r]
+            # a raised alarm holds against the clear level, nan never satisfies a condition
+            if 'above' in rule:
+                holds = [m and v > (clear if s else threshold) for (v, s, m) in zip(column, raised, self._matches[r])]
+            else:
+                holds = [m and v < (clear if s else threshold) for (v, s, m) in zip(column, raised, self._matches[r])]
+            changing = [j for (j, (h, s, p)) in enumerate(zip(holds, raised, pending)) if h != s or p == p]
+            for j in changing:
+                if holds[j] == raised[j]:
+                    pending[j] = math.nan
+                    continue
+                if pending[j] != pending[j]:
+                    pending[j] = now
+                if now - pending[j] >= rule.get('for', 0):
+                    raised[j] = holds[j]
+                    pending[j] = math.nan
+                    self._changed[r][j] = now
+                    changes.append(self._keys[j] + (rule['name'], bool(raised[j]), column[j]))
+        return changes
+
+    def active(self):
+        # returns [{'frame', 'channel', 'rule', 'since'}] of the raised alarms
+        alarms = []
+        for (r, rule) in enumerate(self.rules):
+            for (j, s) in enumerate(self._raised[r]):
+                if s:
+                    frame_id, ch_id = self._keys[j]
+                    alarms.append({
+                        'frame': frame_id, 'channel': ch_id, 'rule': rule['name'], 'since': self._changed[r][j],
+                    })
+        return alarms
+
+
+class EburStatsPublisher:
+    # Fans loudness values parsed from one ffmpeg process out to the stats segments (and the optional text exporters)
+    # of every frame it renders. Frames sharing a source share its channel tags (see _get_frame_stats).
+    def __init__(self, frames, alarms=None):
+        self.frames = frames
+        self.alarms = alarms
+        # frame -> [alarm engine slot of every channel]
+        self._alarm_slots = [
+            [alarms.add(f['id'], ch_id, time.time()) for ch_id in f['channel_ids']] for f in frames
+        ] if alarms is not None else None
+        # tag -> [(frame index, channel index within the frame)]
+        destinations = {}
+        for (k, f) in enumerate(frames):
+            for (ch, ch_id) in enumerate(f['channel_ids']):
+                destinations.setdefault('{}{}'.format(f['tag_prefix'], ch_id), []).append((k, ch))
+        self.channel_tags = list(destinations)
+        self._destinations = list(destinations.values())
+        self._segments = []
+        self._histories = [None] * len(frames)  # kept open across process restarts
+        self._latest = []
+        self._reported = []
+        self.updates = [0] * len(frames)
+        self.last_update = [None] * len(frames)  # time.time() of the last update of every frame
+        resolutions = [
+            resolution for f in frames if f['history_path'] is not None for (resolution, _) in f['history_tiers']
+        ]
+        self._pts_resolution = min(resolutions) if resolutions else None
+        self._pts_origin = None  # wall-clock time of pts 0
+
+    def open(self):
+        # on OSError the segments created so far are left open, close() releases them
+        self._segments = []
+        for f in self.frames:
+            self._segments.append(EburStatsSegment.create(f['shm_path'], f['channel_ids']))
+        for (k, f) in enumerate(self.frames):
+            if f['history_path'] is not None and self._histories[k] is None:
+                self._histories[k] = LoudnessHistory.create(
+                    f['history_path'], f['channel_ids'], f['history_tiers'], {'source': f['source'], 'frame': f['name']}
+                )
+        self._latest = [[None] * len(f['channel_ids']) for f in self.frames]
+        self._reported = [set() for _ in self.frames]
+        self._pts_origin = None
+
+    def _get_sample_time(self, pts_time, now):
+        # History buckets are filled by the time a sample was measured at: the arrival time jitters with the pipe and
+        # the event loop, which puts two samples in one bucket and none in the next. The wall-clock time of pts 0 is
+        # taken from the first sample (and again after a pts discontinuity or a stall), in the middle of a bucket of
+        # the finest tier so that evenly spaced samples stay off the bucket boundaries.
+        if pts_time is None or self._pts_resolution is None or not math.isfinite(pts_time):
+            return now
+        if self._pts_origin is None or abs(self._pts_origin + pts_time - now) > EBUR_PTS_MAX_DRIFT:
+            self._pts_origin = (math.floor((now - pts_time) / self._pts_resolution) + 0.5) * self._pts_resolution
+        return self._pts_origin + pts_time
+
+    def publish(self, n, values, pts_time=None):
+        now = time.time()
+        sample_time = self._get_sample_time(pts_time, now)
+        for (k, ch) in self._destinations[n]:
+            f = self.frames[k]
+            self._segments[k].update(ch, *values)
+            self.updates[k] += 1
+            self.last_update[k] = now
+            if self._histories[k] is not None:
+                self._histories[k].add(ch, sample_time, *values)
+            if self._alarm_slots is not None:
+                self.alarms.update(self._alarm_slots[k][ch], now, values)
+            if f['stats_path'] is not None:
+                self._latest[k][ch] = '{} {}'.format(f['channel_ids'][ch], ' '.join(map(str, values)))
+                self._reported[k].add(ch)
+                if len(self._reported[k]) == len(f['channel_ids']):
+                    self._write_text(f['stats_path'], self._latest[k])
+                    self._reported[k].clear()
+
+    def latest(self):
+        # [(frame id, [(channel id, timestamp, M, S, I, LRA) or None])] while the segments are open
+        return [
+            (f['id'], [(ch_id,) + r[1:] if r is not None else None for (ch_id, r) in zip(f['channel_ids'], records)])
+            for (f, records) in zip(self.frames, (segment.snapshot() for segment in self._segments))
+        ]
+
+    def close(self):
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
+
+    def close_history(self):
+        for history in filter(None, self._histories):
+            history.close()
+        self._histories = [None] * len(self.frames)
+
+    def remove(self, keep=()):
+        # history and thumbnail files listed in keep ((path, source, frame name) of the frames still shown) are left
+        # in place for the processes taking their frames over, those of another source or frame are removed
+        self.close()
+        self.close_history()
+        if self._alarm_slots is not None:
+            for slot in (slot for slots in self._alarm_slots for slot in slots):
+                self.alarms.discard(slot)
+            self._alarm_slots = None
+        for f in self.frames:
+            paths = [f['shm_path'], f['stats_path']]
+            paths += [f[k] for k in ('history_path', 'thumbnail_path') if (f[k], f['source'], f['name']) not in keep]
+            for path in filter(None, paths):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _write_text(ebur_stats_path, stats):
+        # compatibility text exporter, replaced atomically so readers never see a partial file
+        tmp_path = '{}.tmp'.format(ebur_stats_path)
+        with open(tmp_path, 'w') as fout:
+            for s in stats:
+                fout.write('{}\n'.format(s))
+        os.replace(tmp_path, ebur_stats_path)
+
+
+class SupervisedProcess:
+    def __init__(self, spec, alarms=None):
+        self.name = spec['name']
+        self.args = spec['args']
+        self.log_path = spec['log_path']
+        self.cpus = spec['cpus']
+        self.publisher = EburStatsPublisher(spec['frames'], alarms)
+        self.pid = None
+        self.started = None  # loop time the running ffmpeg process was started at
+        self.admitted = False  # holds a connection slot (see Supervisor._admit)
+        self.stop = asyncio.Event()
+        self.state = None
+        self.failures = 0  # consecutive short-lived runs
+        self.reprobed = False  # sources probed again since the process last got past STARTING
+        self.restarts = 0
+        self.last_data = None
+        self.hung = asyncio.Event()  # set by the watchdog, the process is restarted
+
+    @staticmethod
+    def key(spec):
+        # processes with equal keys are interchangeable, a layout reload keeps them running (see _plan_cpu_budget)
+        return json.dumps([spec['base_args'], spec['frames']], sort_keys=True)
+
+
+class Supervisor:
+    # Runs every ffmpeg process from a single asyncio event loop. Both pipes of every process are read concurrently
+    # (stdout carries EBUR metadata, stderr diagnostics), exited processes are restarted after an exponential,
+    # jittered backoff and the whole set is terminated on SIGTERM/SIGINT.
+    # If a reload callable is given, it is called (in a worker thread) whenever watch_path changes or SIGHUP is
+    # received; it returns the new process specs (None to keep the current ones) and only the processes whose
+    # spec changed are stopped or started.
+    # Launches are staggered by an admission token bucket and a limit on processes still connecting, so a large
+    # wall does not hit the origin server with every connection at once.
+    # Alarm rules (if any) are evaluated every ALARM_INTERVAL seconds, state changes are logged and the raised alarms
+    # are written to ALARM_STATE_PATH for web.py.
+    # Thumbnails (if enabled) come from the same processes through a FIFO per frame, only the latest one is kept.
+    # If a start_failed callable is given, it is called (in a worker thread) with the sources of a process that
+    # exited before sending any EBUR metadata (once per run of consecutive failures); a true result triggers a reload.
+    STARTING = 'starting'
+    RUNNING = 'running'
+    DEGRADED = 'degraded'  # process alive but no EBUR metadata for a while
+    BACKING_OFF = 'backing off'
+    FAILED = 'failed'  # restart limit reached
+    STOPPED = 'stopped'
+
+    def __init__(self, processes, log_sink, conf, log, reload=None, watch_path=None, metrics=None, tasks=(),
+                 start_failed=None):
+        self.specs = processes
+        self.processes = {}  # key -> SupervisedProcess
+        self.log_sink = log_sink
+        self.conf = conf
+        self._log = log
+        self._reload = reload
+        self._watch_path = watch_path
+        self._start_failed = start_failed
+        self._tasks = {}  # key -> supervising task
+        self.alarms = AlarmEngine(conf.ALARM_RULES) if conf.ALARM_RULES else None
+        self._frame_logs = {}  # frame id -> log path of the process rendering it
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._extra_tasks = tasks  # coroutine functions run alongside the processes, given the supervisor
+        self._launch_tokens = conf.SUPERVISOR_LAUNCH_BURST
+        self._launch_tokens_time = None
+        self._starting = None
+        self._stop = None
+        self._reload_requested = None
+
+    def run(self):
+        asyncio.run(self._main())
+
+    def stop(self):
+        self._stop.set()
+        for p in self.processes.values():
+            p.stop.set()
+
+    def request_reload(self):
+        self._reload_requested.set()
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        self._install_child_watcher(loop)
+        self._stop = asyncio.Event()
+        self._reload_requested = asyncio.Event()
+        if self.conf.SUPERVISOR_MAX_STARTING:
+            self._starting = asyncio.Semaphore(self.conf.SUPERVISOR_MAX_STARTING)
+        handlers = [(signal.SIGTERM, self.stop), (signal.SIGINT, self.stop)]
+        if self._reload is not None and hasattr(signal, 'SIGHUP'):
+            handlers.append((signal.SIGHUP, self.request_reload))
+        for (sig, handler) in handlers:
+            try:
+                loop.add_signal_handler(sig, handler)
+            except NotImplementedError:
+                signal.signal(sig, lambda *_, h=handler: loop.call_soon_threadsafe(h))
+        for f in (f for spec in self.specs for f in spec['frames'] if f['thumbnail_path'] is not None):
+            # left over by an earlier run, possibly of another source
+            try:
+                os.remove(f['thumbnail_path'])
+            except FileNotFoundError:
+                pass
+        await self._apply(self.specs)
+        background = [asyncio.ensure_future(self._watchdog())]
+        if self.alarms is not None:
+            background.append(asyncio.ensure_future(self._alarm_ticker()))
+        if self.conf.METRICS_PATH is not None:
+            background.append(asyncio.ensure_future(self._metrics_writer()))
+        if self._reload is not None:
+            background.append(asyncio.ensure_future(self._reloader()))
+            if self._watch_path is not None and self.conf.LAYOUT_WATCH_INTERVAL:
+                background.append(asyncio.ensure_future(self._watch()))
+        background += [asyncio.ensure_future(task(self)) for task in self._extra_tasks]
+        await self._stop.wait()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*self._tasks.values())
+        for path in (self.conf.ALARM_STATE_PATH if self.alarms is not None else None, self.conf.METRICS_PATH):
+            try:
+                if path is not None:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def _apply(self, specs):
+        new_specs = {SupervisedProcess.key(spec): spec for spec in specs}
+        removed = [key for key in self.processes if key not in new_specs]
+        added = [key for key in new_specs if key not in self.processes]
+        for key in removed:
+            self.processes[key].stop.set()
+        await asyncio.gather(*[self._tasks.pop(key) for key in removed])
+        kept_paths = {
+            (f[k], f['source'], f['name'])
+            for spec in specs for f in spec['frames'] for k in ('history_path', 'thumbnail_path')
+        }
+        for key in removed:
+            # frames that are still shown get their segments recreated by the processes started below
+            p = self.processes.pop(key)
+            p.publisher.remove(keep=kept_paths)
+            self.metrics.remove({'process': p.name})
+        for (key, p) in self.processes.items():
+            # a new CPU budget is applied at once, the new args at the next restart
+            p.args = new_specs[key]['args']
+            p.cpus = new_specs[key]['cpus']
+            if p.pid is not None:
+                self._set_affinity(p.pid, p.cpus)
+        for key in added:
+            p = SupervisedProcess(new_specs[key], self.alarms)
+            self.processes[key] = p
+            self._tasks[key] = asyncio.ensure_future(self._supervise(p))
+        self.specs = specs
+        self._frame_logs = {f['id']: p.log_path for p in self.processes.values() for f in p.publisher.frames}
+        return len(removed), len(added)
+
+    async def _reloader(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._reload_requested.wait()
+            self._reload_requested.clear()
+            self._log('Reloading layout...')
+            specs = await loop.run_in_executor(None, self._reload)
+            if specs is None or self._stop.is_set():
+                continue
+            removed, added = await self._apply(specs)
+            self._log('Layout reloaded: {} process(es) stopped, {} started, {} unchanged.'.format(
+                removed, added, len(self.processes) - added
+            ))
+
+    async def _watch(self):
+        last = self._stat_watch_path()
+        while True:
+            await asyncio.sleep(self.conf.LAYOUT_WATCH_INTERVAL)
+            current = self._stat_watch_path()
+            if current != last:
+                last = current
+                self.request_reload()
+
+    def _stat_watch_path(self):
+        try:
+            st = os.stat(self._watch_path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    @staticmethod
+    def _install_child_watcher(loop):
+        # the default child watcher of Python < 3.12 blocks a thread per child process in waitpid()
+        if sys.version_info < (3, 12) and hasattr(asyncio, 'PidfdChildWatcher'):
+            try:
+                os.close(os.pidfd_open(os.getpid()))
+            except (AttributeError, OSError):
+                return
+            watcher = asyncio.PidfdChildWatcher()
+            watcher.attach_loop(loop)
+            asyncio.set_child_watcher(watcher)
+
+    @staticmethod
+    def _set_affinity(pid, cpus):
+        # every thread of the process, the ones it starts later inherit the affinity
+        if cpus is None or not hasattr(os, 'sched_setaffinity'):
+            return
+        try:
+            tids = [int(tid) for tid in os.listdir('/proc/{}/task'.format(pid))]
+        except OSError:
+            tids = [pid]
+        for tid in tids:
+            try:
+                os.sched_setaffinity(tid, cpus)
+            except OSError:
+                pass
+
+    async def _admit(self, p):
+        # waits for a launch token and a connection slot, returns False if the process was stopped meanwhile
+        loop = asyncio.get_running_loop()
+        rate = self.conf.SUPERVISOR_LAUNCH_RATE
+        while rate and not p.stop.is_set():
+            now = loop.time()
+            if self._launch_tokens_time is not None:
+                self._launch_tokens = min(self.conf.SUPERVISOR_LAUNCH_BURST,
+                                          self._launch_tokens + (now - self._launch_tokens_time) * rate)
+            self._launch_tokens_time = now
+            if self._launch_tokens >= 1:
+                self._launch_tokens -= 1
+                break
+            try:
+                await asyncio.wait_for(p.stop.wait(), (1 - self._launch_tokens) / rate)
+            except asyncio.TimeoutError:
+                pass
+        if self._starting is not None and not p.stop.is_set():
+            acquire = asyncio.ensure_future(self._starting.acquire())
+            stop_wait = asyncio.ensure_future(p.stop.wait())
+            await asyncio.wait([acquire, stop_wait], return_when=asyncio.FIRST_COMPLETED)
+            stop_wait.cancel()
+            if not acquire.done():
+                acquire.cancel()
+            elif acquire.exception() is None:
+                p.admitted = True
+        if p.stop.is_set():
+            self._release(p)
+            return False
+        return True
+
+    def _release(self, p):
+        if p.admitted:
+            p.admitted = False
+            self._starting.release()
+
+    def _set_state(self, p, state):
+        if p.state == state:
+            return
+        if state != self.STARTING:
+            self._release(p)
+        self.log_sink.write(p.log_path, 'State: {} -> {}.'.format(p.state, state))
+        self._log('ffmpeg process ({}) is {}.'.format(p.name, state))
+        p.state = state
+
+    async def _watchdog(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(1)
+            for p in self.processes.values():
+                if not p.publisher.channel_tags or p.last_data is None:
+                    continue
+                silent = loop.time() - p.last_data
+                if p.state in (self.STARTING, self.RUNNING) and silent > self.conf.SUPERVISOR_DEGRADED_TIMEOUT:
+                    self._set_state(p, self.DEGRADED)
+                if p.state == self.DEGRADED and self.conf.SUPERVISOR_HUNG_TIMEOUT and \
+                        silent > self.conf.SUPERVISOR_HUNG_TIMEOUT and not p.hung.is_set():
+                    # alive but stuck (a stalled input, a wedged filtergraph), only a restart gets it going again
+                    self.log_sink.write(p.log_path, 'No EBUR metadata for {:.0f} s - restarting.'.format(silent))
+                    p.hung.set()
+
+    async def _alarm_ticker(self):
+        loop = asyncio.get_running_loop()
+        self._write_alarms()
+        written = loop.time()
+        while True:
+            await asyncio.sleep(self.conf.ALARM_INTERVAL)
+            changes = self.alarms.evaluate(time.time())
+            for (frame_id, ch_id, rule, raised, value) in changes:
+                msg = 'Alarm "{}" {} on frame {} channel {} ({:.1f}).'.format(
+                    rule, 'raised' if raised else 'cleared', frame_id, ch_id, value
+                )
+                self._log(msg)
+                if frame_id in self._frame_logs:
+                    self.log_sink.write(self._frame_logs[frame_id], msg)
+            if changes or loop.time() - written >= ALARM_STATE_REFRESH_INTERVAL:
+                self._write_alarms()
+                written = loop.time()
+
+    async def _metrics_writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await loop.run_in_executor(None, self._write_metrics, self._collect_metrics())
+            await asyncio.sleep(self.conf.METRICS_INTERVAL)
+
+    def _collect_metrics(self):
+        # the process and frame values are read from the supervisor state, the rest was recorded as it happened
+        loop = asyncio.get_running_loop()
+        now = time.time()
+        processes = []
+        for p in self.processes.values():
+            labels = {'process': p.name}
+            self.metrics.set('monitor_ffmpeg_up', labels, int(p.pid is not None))
+            self.metrics.set('monitor_ffmpeg_restarts_total', labels, p.restarts)
+            self.metrics.set('monitor_ffmpeg_uptime_seconds', labels,
+                             loop.time() - p.started if p.pid is not None else 0)
+            for state in (self.STARTING, self.RUNNING, self.DEGRADED, self.BACKING_OFF, self.FAILED, self.STOPPED):
+                self.metrics.set('monitor_ffmpeg_state', dict(labels, state=state), int(p.state == state))
+            for (f, updates, last_update) in zip(p.publisher.frames, p.publisher.updates, p.publisher.last_update):
+                frame_labels = dict(labels, frame=str(f['id']))
+                self.metrics.set('monitor_ebur_updates_total', frame_labels, updates)
+                if last_update is not None:
+                    self.metrics.set('monitor_ebur_staleness_seconds', frame_labels, now - last_update)
+            processes.append({'name': p.name, 'pid': p.pid})
+        return {'time': now, 'processes': processes, 'metrics': self.metrics.snapshot()}
+
+    def _write_metrics(self, snapshot):
+        tmp_path = '{}.tmp'.format(self.conf.METRICS_PATH)
+        with open(tmp_path, 'w') as fout:
+            json.dump(snapshot, fout)
+        os.replace(tmp_path, self.conf.METRICS_PATH)
+
+    def _write_alarms(self):
+        if self.conf.ALARM_STATE_PATH is None:
+            return
+        tmp_path = '{}.tmp'.format(self.conf.ALARM_STATE_PATH)
+        with open(tmp_path, 'w') as fout:
+            json.dump({'time': time.time(), 'alarms': self.alarms.active()}, fout)
+        os.replace(tmp_path, self.conf.ALARM_STATE_PATH)
+
+    async def _supervise(self, p):
+        loop = asyncio.get_running_loop()
+        while not p.stop.is_set():
+            self._set_state(p, self.STARTING)
+            p.last_data = None
+            p.hung.clear()
+            if not await self._admit(p):
+                break
+            self.log_sink.write(p.log_path, 'Starting ffmpeg process {}'.format(' '.join(p.args)))
+            last_lines_log = deque(maxlen=5)
+            started = loop.time()
+            thumbnails = []
+            proc = None
+            try:
+                p.publisher.open()
+                thumbnails = await self._open_thumbnails(p)
+                proc = await asyncio.create_subprocess_exec(
+                    *p.args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=1024 * 1024
+                )
+            except OSError as e:
+                await self._close_thumbnails(thumbnails, [])
+                p.publisher.close()
+                self.log_sink.write(p.log_path, 'ffmpeg process failed to start: {}.'.format(str(e)))
+            else:
+                p.pid = proc.pid
+                p.started = loop.time()
+                self._set_affinity(proc.pid, p.cpus)
+                self.log_sink.write(p.log_path, 'ffmpeg process started')
+                p.last_data = loop.time()
+                if not p.publisher.channel_tags:
+                    self._set_state(p, self.RUNNING)
+                readers = asyncio.ensure_future(asyncio.gather(
+                    self._read_metadata(p, proc.stdout), self._read_stderr(p, proc.stderr, last_lines_log)
+                ))
+                thumbnail_readers = [
+                    asyncio.ensure_future(self._read_thumbnails(p, f, stream)) for (f, stream, _, _) in thumbnails
+                ]
+                stop_wait = asyncio.ensure_future(p.stop.wait())
+                hung_wait = asyncio.ensure_future(p.hung.wait())
+                await asyncio.wait([readers, stop_wait, hung_wait], return_when=asyncio.FIRST_COMPLETED)
+                stop_wait.cancel()
+                hung_wait.cancel()
+                if (p.stop.is_set() or p.hung.is_set()) and proc.returncode is None:
+                    await self._terminate(proc)
+                await readers
+                await proc.wait()
+                await self._close_thumbnails(thumbnails, thumbnail_readers)
+                p.pid = None
+                p.publisher.close()
+                self.log_sink.write(p.log_path, 'ffmpeg process stopped (code {}). Output:\n"{}".'.format(
+                    proc.returncode, '\n'.join(last_lines_log)
+                ))
+            if p.stop.is_set():
+                break
+            if p.state != self.STARTING:
+                p.reprobed = False
+            elif proc is not None and not p.reprobed and self._start_failed is not None:
+                # only on the first of consecutive failed starts, a source that is down is not probed on every restart
+                p.reprobed = True
+                sources = sorted({f['source'] for f in p.publisher.frames})
+                if await loop.run_in_executor(None, self._start_failed, sources):
+                    self.request_reload()
+            if loop.time() - started >= self.conf.SUPERVISOR_STABLE_TIME:
+                p.failures = 0
+            p.failures += 1
+            if self.conf.SUPERVISOR_MAX_RESTARTS and p.failures > self.conf.SUPERVISOR_MAX_RESTARTS:
+                self.log_sink.write(p.log_path, 'Giving up after {} consecutive failures.'.format(p.failures))
+                self._set_state(p, self.FAILED)
+                return
+            delay = min(self.conf.SUPERVISOR_BACKOFF_MAX, self.conf.SUPERVISOR_BACKOFF_MIN * 2 ** (p.failures - 1))
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            self.log_sink.write(p.log_path, 'Restarting in {:.1f} s.'.format(delay))
+            self._set_state(p, self.BACKING_OFF)
+            try:
+                await asyncio.wait_for(p.stop.wait(), delay)
+            except asyncio.TimeoutError:
+                p.restarts += 1
+        p.publisher.close_history()
+        self._set_state(p, self.STOPPED)
+
+    async def _terminate(self, proc):
+        proc.terminate()
+        try:
+            await asyncio.wait_for(proc.wait(), self.conf.SUPERVISOR_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+
+    async def _open_thumbnails(self, p):
+        # A FIFO per frame for ffmpeg to write its JPEG snapshots into, returns [(frame, stream, transport, write fd)].
+        # The supervisor holds a write end as well: a FIFO without writers reads as EOF, so the readers only see EOF
+        # once ffmpeg has exited and _close_thumbnails closed it.
+        loop = asyncio.get_running_loop()
+        thumbnails = []
+        try:
+            for f in p.publisher.frames:
+                if f['thumbnail_path'] is None:
+                    continue
+                fifo_path = f['thumbnail_path'] + THUMBNAIL_FIFO_SUFFIX
+                try:
+                    os.remove(fifo_path)
+                except FileNotFoundError:
+                    pass
+                os.mkfifo(fifo_path, 0o600)
+                read_fd = os.open(fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+                write_fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+                stream = asyncio.StreamReader(limit=THUMBNAIL_MAX_BYTES)
+                try:
+                    transport, _ = await loop.connect_read_pipe(
+                        lambda: asyncio.StreamReaderProtocol(stream), os.fdopen(read_fd, 'rb', buffering=0)
+                    )
+                except BaseException:
+                    os.close(write_fd)
+                    raise
+                thumbnails.append((f, stream, transport, write_fd))
+        except BaseException:
+            await self._close_thumbnails(thumbnails, [])
+            raise
+        return thumbnails
+
+    @staticmethod
+    async def _close_thumbnails(thumbnails, readers):
+        for (f, _, _, write_fd) in thumbnails:
+            os.close(write_fd)
+        await asyncio.gather(*readers)
+        for (f, _, transport, _) in thumbnails:
+            transport.close()
+            try:
+                os.remove(f['thumbnail_path'] + THUMBNAIL_FIFO_SUFFIX)
+            except FileNotFoundError:
+                pass
+
+    async def _read_thumbnails(self, p, f, stream):
+        # ffmpeg writes the JPEGs back to back, the last complete one replaces the thumbnail file atomically
+        data = b''
+        failed = False
+        while True:
+            chunk = await stream.read(THUMBNAIL_MAX_BYTES)
+            if not chunk:
+                return
+            data += chunk
+            end = data.rfind(b'\xff\xd9')
+            if end < 0:
+                if len(data) > THUMBNAIL_MAX_BYTES:
+                    data = b''
+                continue
+            start = data.rfind(b'\xff\xd8', 0, end)
+            if start >= 0:
+                try:
+                    self._write_thumbnail(f['thumbnail_path'], data[start:end + 2])
+                except OSError as e:
+                    if not failed:
+                        self.log_sink.write(p.log_path, 'Failed to write thumbnail: {}.'.format(str(e)))
+                    failed = True
+                else:
+                    failed = False
+            data = data[end + 2:]
+
+    @staticmethod
+    def _write_thumbnail(path, image):
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'wb') as fout:
+            fout.write(image)
+        os.replace(tmp_path, path)
+
+    async def _read_metadata(self, p, stream):
+        loop = asyncio.get_running_loop()
+        parser = EburMetadataParser(p.publisher.channel_tags)
+        labels = {'process': p.name}
+        while True:
+            line = await stream.readline()
+            if not line:
+                return
+            started = time.perf_counter()
+            try:
+                parsed = parser.feed(line.decode(errors='replace'))
+            except ValueError as e:
+                self.log_sink.write(p.log_path, '<WARNING> EBUR metadata parsing error: {}'.format(str(e)))
+                continue
+            finally:
+                self.metrics.observe('monitor_ebur_parse_seconds', labels, time.perf_counter() - started)
+            if parsed is None:
+                continue
+            p.publisher.publish(*parsed)
+            p.last_data = loop.time()
+            if p.state != self.RUNNING:
+                self._set_state(p, self.RUNNING)
+
+    async def _read_stderr(self, p, stream, lines):
+        labels = {'process': p.name}
+        while True:
+            line = await stream.readline()
+            if not line:
+                return
+            self.metrics.inc('monitor_ffmpeg_stderr_lines_total', labels)
+            lines.append(line.decode(errors='replace'))
 
 
 class Application:
@@ -84,9 +1549,19 @@ class Application:
         self.verbosity = parsed_args.verbosity
         self.command = parsed_args.command
         self.args = parsed_args
+        apply_conf_defaults(self.conf)
 
         self.layout = None
+        self.layout_path = None
+        self.layout_map_height = None
         self.layout_source_info = None
+        self.probe_cache = None
+        self.layout_cache = FileCache(self.conf.LAYOUT_CACHE_PATH, max_entries=LAYOUT_CACHE_ENTRIES)
+        self.skipped_sources = set()  # sources whose probe failed, see _retry_skipped_sources
+        self.metrics = Metrics()
+        self.capabilities = None
+        self.frame_filter = None  # ids of the frames this node runs, all of them if None
+        self.assignment = None  # (layout, map height, frame ids) from the coordinator, see _reload_assigned_processes
 
     def _error(self, msg):
         sys.stderr.write('<ERROR> {}\n'.format(msg))
@@ -121,10 +1596,69 @@ class Application:
             self._conf_check()
         except ConfException as e:
             self._error(str(e))
-        else:
-            self._log('OK')
+        if self.args.layout is not None:
+            try:
+                self._layout_check()
+            except LayoutException as e:
+                self._error(str(e))
+        self._log('OK')
 
     def _cmd_run(self):
+        if self.args.mosaic and (self.args.shard is not None or self.args.coordinator is not None):
+            self._error('--mosaic can not be combined with --shard or --coordinator.')
+        if (self.args.layout is None) == (self.args.coordinator is None):
+            self._error('Either a layout (-l) or a coordinator (--coordinator) is required.')
+        try:
+            self._conf_check()
+        except ConfException as e:
+            self._error(str(e))
+        log_sink = LogSink(self.conf.LOG_FLUSH_INTERVAL, self.conf.LOG_FLUSH_SIZE, self.conf.LOG_MAX_BYTES,
+                           self.conf.LOG_BACKUP_COUNT, self.conf.LOG_REPEAT_WINDOW)
+        node = self.args.node
+        if self.args.coordinator is not None:
+            # the layout and the frames to run come from the coordinator, nothing runs until they do
+            node = node or '{}.{}'.format(socket.gethostname(), os.getpid())
+            worker = ClusterWorker(self.conf, self._log, self.args.coordinator, node, len(self._get_budget_cpus()),
+                                   self._set_assignment)
+            processes = []
+            reload = self._reload_assigned_processes
+            watch_path = None
+            tasks = (worker.run,)
+        else:
+            try:
+                self._layout_check()
+            except LayoutException as e:
+                self._error(str(e))
+            if self.args.shard is not None:
+                node = node or 'shard{}'.format(self.args.shard[0])
+            processes = self._get_processes()
+            if not processes:
+                if not (self.skipped_sources and self.conf.PROBE_RETRY_INTERVAL):
+                    self._error('No frame could be started.')
+                # every source is down for now, their frames are started as they come back (see _retry_skipped_sources)
+                self._warning('No frame could be started yet - probing the sources again every {:g} s.'.format(
+                    self.conf.PROBE_RETRY_INTERVAL
+                ))
+            reload = self._reload_processes
+            watch_path = self.layout_path
+            tasks = ()
+        if self.conf.PROBE_RETRY_INTERVAL:
+            tasks += (self._retry_skipped_sources,)
+        if node is not None:
+            # nodes sharing a host keep their own alarm state and metrics
+            for p in ('ALARM_STATE_PATH', 'METRICS_PATH'):
+                if getattr(self.conf, p) is not None:
+                    setattr(self.conf, p, '{}.{}'.format(getattr(self.conf, p), node))
+        log_sink.start()
+        self._info('Starting supervisor...')
+        Supervisor(
+            processes, log_sink, self.conf, self._log, reload=reload, watch_path=watch_path, metrics=self.metrics,
+            tasks=tasks, start_failed=self._refresh_source_info
+        ).run()
+        log_sink.close()
+        self._log('Stopped.')
+
+    def _cmd_coordinate(self):
         try:
             self._conf_check()
         except ConfException as e:
@@ -133,86 +1667,432 @@ class Application:
             self._layout_check()
         except LayoutException as e:
             self._error(str(e))
-        ffmpeg_threads = []
-        for (i, ls) in enumerate(map(self._get_source_info, [f['source'] for f in self.layout])):
-            audio_streams = []
-            video_streams = []
-            for s in ls['streams']:
-                if s['codec_type'] == 'video':
-                    self._info('Source {} - found video stream #{}.'.format(i, s['index']))
-                    video_streams.append(s)
-                elif s['codec_type'] == 'audio':
-                    self._info('Source {} - found audio stream #{}.'.format(i, s['index']))
-                    audio_streams.append(s)
-            video_height = self.layout[i]['video_height']
-            graph, meter_ratio, audio_channel_ids = self._get_meter_graph(
-                audio_streams, self.layout[i]['meter_channel_font'], self.layout[i]['meter_channel_font_size']
-            )
-            self._info('Scaling source video...')
-            vs = video_streams[0]
+        Coordinator(
+            self.conf, self._log, self._warning, self.args.listen, self._get_cluster_plan(),
+            reload=self._reload_cluster_plan, watch_path=self.layout_path
+        ).run()
+        self._log('Stopped.')
+
+    def _set_assignment(self, layout, frames):
+        # called by the cluster worker, the reload thread picks the assignment up (see _reload_assigned_processes)
+        self.assignment = (layout['frames'], layout['map_height'], set(frames))
+
+    def _reload_assigned_processes(self):
+        if self.assignment is None:
+            return None
+        self.layout, self.layout_map_height, self.frame_filter = self.assignment
+        return self._get_processes()
+
+    def _get_cluster_plan(self):
+        # (compiled layout, {group: [frame id]}, {group: cost}) for the coordinator
+        groups, costs = self._get_frame_groups(self._probe_sources([f['source'] for f in self.layout]))
+        self._info('Frame group costs: {}.'.format(', '.join(
+            '{} ({:.3g})'.format('+'.join(map(str, groups[g])), costs[g]) for g in groups
+        )))
+        return {'frames': self.layout, 'map_height': self.layout_map_height}, groups, costs
+
+    def _reload_cluster_plan(self):
+        self.layout = None
+        try:
+            self._layout_check()
+        except LayoutException as e:
+            self._warning('Layout reload failed, keeping the current one: {}'.format(str(e)))
+            return None
+        return self._get_cluster_plan()
+
+    def _get_frame_groups(self, sources_info):
+        # ({group: [frame id]}, {group: cost}), groups are the frames sharing a source (and so a process), named after
+        # their first frame. The cost is the output pixel area of the frames plus decoding the source (as large as
+        # its largest frame), all frames assumed 16:9, plus metering the audio channels of the source. It comes from
+        # the layout and the probed channel counts only, so shards seeing the same streams compute the same split.
+        groups = {}
+        costs = {}
+        for (source, frame_ids) in self._get_source_groups():
+            heights = [self.layout[i]['video_height'] for i in frame_ids]
+            groups[frame_ids[0]] = frame_ids
+            costs[frame_ids[0]] = (sum(h * h for h in heights) + SOURCE_DECODE_WEIGHT * max(heights) ** 2) * 16 / 9 + \
+                METER_CHANNEL_PIXELS * self._get_source_channels(sources_info[source])
+        return groups, costs
+
+    @staticmethod
+    def _get_source_channels(source_info):
+        if isinstance(source_info, FrameInputException):
+            return DEFAULT_SOURCE_CHANNELS
+        return sum(s.get('channels', 0) for s in source_info['streams'] if s['codec_type'] == 'audio')
+
+    def _get_shard_frames(self, sources_info):
+        k, n = self.args.shard
+        groups, costs = self._get_frame_groups(sources_info)
+        assignment = partition_groups(costs, {shard: 1 for shard in range(1, n + 1)})
+        frames = {i for (g, shard) in assignment.items() if shard == k for i in groups[g]}
+        self._info('Shard {}/{}: frame(s) {}.'.format(k, n, ', '.join(map(str, sorted(frames))) or 'none'))
+        return frames
+
+    def _get_processes(self):
+        if self.args.shard is not None:
+            # every shard probes every source, the split depends on their channel counts
+            sources_info = self._probe_sources([f['source'] for f in self.layout])
+            self.frame_filter = self._get_shard_frames(sources_info)
+        else:
+            sources_info = self._probe_sources([
+                f['source'] for (i, f) in enumerate(self.layout) if self.frame_filter is None or i in self.frame_filter
+            ])
+        self.skipped_sources = {
+            f['source'] for (i, f) in enumerate(self.layout)
+            if (self.frame_filter is None or i in self.frame_filter) and
+            isinstance(sources_info[f['source']], FrameInputException)
+        }
+        if self.args.mosaic:
+            processes = self._get_mosaic_processes(sources_info)
+        else:
+            processes = self._get_frame_processes(sources_info)
+        self._plan_cpu_budget(processes)
+        for p in processes:
+            self._info('Args ({}): {}'.format(p['name'], p['args']))
+        return processes
+
+    def _plan_cpu_budget(self, processes):
+        # Splits the CPUs between the processes in proportion to their pixel rate. Every process gets a contiguous
+        # set of CPUs (small ones share a CPU) as its affinity and as many decoder, filter and encoder threads as its
+        # share rounds up to. If the layout needs more CPU than available at the configured x264 preset, every
+        # process gets the same faster preset, so a larger layout costs quality evenly instead of dropping frames
+        # at random. The budget-free args are kept in 'base_args': changing the budget alone restarts nothing.
+        for p in processes:
+            p['base_args'] = p['args']
+            p['cpus'] = None
+        if not self.conf.CPU_BUDGET or not processes:
+            return
+        cpus = self._get_budget_cpus()
+        needs = [p['pixel_rate'] / self.conf.CPU_CORE_PIXEL_RATE for p in processes]
+        load = sum(needs) / len(cpus)
+        presets = [name for (name, _) in X264_PRESET_SPEEDS]
+        speeds = dict(X264_PRESET_SPEEDS)
+        args = self.conf.FFMPEG_OUT_ARGS
+        base_preset = args[args.index('-preset') + 1] if '-preset' in args[:-1] else None
+        preset = base_preset
+        if base_preset in speeds and load > 1:
+            faster = [q for q in presets[presets.index(base_preset):] if speeds[q] / speeds[base_preset] >= load]
+            preset = faster[0] if faster else presets[-1]
+            load = load * speeds[base_preset] / speeds[preset]
+        self._info('CPU budget: {} CPU(s), load {:.0f}% with preset {}.'.format(
+            len(cpus), sum(needs) / len(cpus) * 100, preset
+        ))
+        if load > 1:
+            self._warning('The layout needs {:.0f}% of the CPU budget{} - expect dropped frames.'.format(
+                load * 100, ' even with preset {}'.format(preset) if preset is not None else ''
+            ))
+        start = 0
+        total = sum(needs)
+        for (p, need) in zip(processes, needs):
+            share = need / total * len(cpus)
+            first = min(int(start), len(cpus) - 1)
+            last = min(max(first, math.ceil(start + share) - 1), len(cpus) - 1)
+            start += share
+            threads = max(1, math.ceil(share))
+            p['cpus'] = cpus[first:last + 1]
+            p['args'] = self._get_budget_args(p, threads, preset if preset != base_preset else None)
+            self._info('CPU budget ({}): {:.2f} CPU(s) on {}, {} thread(s).'.format(
+                p['name'], share, ','.join(map(str, p['cpus'])), threads
+            ))
+
+    def _get_budget_cpus(self):
+        if self.conf.CPU_BUDGET_CORES is not None:
+            return sorted(set(self.conf.CPU_BUDGET_CORES))
+        if hasattr(os, 'sched_getaffinity'):
+            return sorted(os.sched_getaffinity(0))
+        return list(range(os.cpu_count() or 1))
+
+    @staticmethod
+    def _get_budget_args(p, threads, preset):
+        # decoder threads go before every input, encoder threads before every output
+        args = p['base_args']
+        graph_at = args.index('-filter_complex') + 1
+        budget_args = []
+        for (k, a) in enumerate(args):
+            if a == '-i' or (k > graph_at and a in p['outputs']):
+                budget_args += ['-threads', str(threads)]
+            if k == graph_at:
+                budget_args += [a, '-filter_complex_threads', str(threads)]
+                continue
+            if preset is not None and k > 0 and args[k - 1] == '-preset':
+                a = preset
+            budget_args.append(a)
+        return budget_args
+
+    def _reload_processes(self):
+        # called by the supervisor when the layout file changes, returns None to keep the running processes
+        self.layout = None
+        try:
+            self._layout_check()
+        except LayoutException as e:
+            self._warning('Layout reload failed, keeping the current one: {}'.format(str(e)))
+            return None
+        return self._get_processes()
+
+    def _get_source_groups(self, frame_filter=None):
+        # [(source, [frame indices])] in order of first appearance, every distinct source is ingested only once
+        groups = {}
+        for (i, f) in enumerate(self.layout):
+            if frame_filter is None or i in frame_filter:
+                groups.setdefault(f['source'], []).append(i)
+        for frame_ids in groups.values():
+            lead = self.layout[frame_ids[0]]
+            for i in frame_ids[1:]:
+                f = self.layout[i]
+                if (f['meter_channel_font'], f['meter_channel_font_size']) != \
+                        (lead['meter_channel_font'], lead['meter_channel_font_size']):
+                    self._warning('Frame {} shares its source with frame {} - using meter font of frame {}.'.format(
+                        i, frame_ids[0], frame_ids[0]
+                    ))
+        return list(groups.items())
+
+    def _get_frame_processes(self, sources_info):
+        # one ffmpeg process per distinct source, with one output per layout frame showing it
+        processes = []
+        for (source, frame_ids) in self._get_source_groups(self.frame_filter):
+            frame_prefixes = [''] if len(frame_ids) == 1 else ['f{}_'.format(i) for i in frame_ids]
             try:
-                l, r = str(vs['sample_aspect_ratio']).split(':')
-            except ValueError:
-                self._warning('SAR error - using SAR = 1.')
-                sar = 1
-            else:
-                sar = float(l) / float(r)
-                self._info('Source SAR = {}.'.format(sar))
-            eff_source_video_width = math.trunc(vs['width'] * sar)
-            source_video_height = vs['height']
-            scale_factor = video_height / source_video_height
-            self._info('Scale factor: {}.'.format(scale_factor))
-            video_width = math.trunc(eff_source_video_width * scale_factor)
-            self._info('Scaled video size: {w}x{h}.'.format(w=video_width, h=video_height))
-            scale_chain = "[v:0]scale={w}:{h},setsar=sar=1[scaled_video]".format(w=video_width, h=video_height)
-            graph.append(scale_chain)
-            self._info('Drawing border...')
-            border_width = 2
-            border_color = '0x00FF00'
-            border_chain = "color=c={border_color}:s={w}x{h}[border_bg];" \
-                           "[border_bg][scaled_video]overlay={bw}:{bw}[bordered_video]" \
-                           "".format(border_color=border_color, w=border_width * 2 + video_width,
-                                     h=border_width * 2 + video_height, bw=border_width)
-            self._info('Border chains: "{}".'.format(border_chain))
-            graph.append(border_chain)
-            self._info('Scale chain: "{}".'.format(scale_chain))
-            self._info('Calculating audio meter size...')
-            self._info('Audio meter ratio: {}.'.format(meter_ratio))
-            meter_width = math.trunc(video_height * meter_ratio)
-            meter_height = border_width * 2 + video_height
-            self._info('Scaled audio meter size: {w}x{h}.'.format(w=meter_width, h=video_height))
-            meter_scale_chain = "[all_meters_out]scale=w={w}:h={h}[scaled_meters]".format(w=meter_width, h=meter_height)
-            self._info('Audio meter scale chain: "{}".'.format(meter_scale_chain))
-            graph.append(meter_scale_chain)
-            total_width = border_width * 2 + video_width + 2 + meter_width
-            total_height = meter_height
-            chain = "color=c=black:s={bg_width}x{bg_height}[main_bg];" \
-                    "[main_bg][scaled_meters]overlay={meters_x_offset}:0[main_mid_0];" \
-                    "[main_mid_0][bordered_video]overlay=0:0[video_out]" \
-                    "".format(bg_width=total_width, bg_height=total_height,
-                              meters_x_offset=border_width * 2 + video_width + 2)
-            self._info('Overlay chains: "{}".'.format(chain))
-            graph.append(chain)
+                graph, audio_channel_ids, out_labels, pixel_rate = self._get_source_graph(
+                    frame_ids, sources_info[source], frame_prefixes
+                )
+            except FrameInputException as e:
+                self._warning('Frame(s) {} skipped: {}'.format(', '.join(map(str, frame_ids)), str(e)))
+                continue
+            thumbnail_args = []
+            for (k, i) in enumerate(frame_ids):
+                out_labels[k], chain, args = self._get_thumbnail_output(i, out_labels[k])
+                graph.extend(chain)
+                thumbnail_args += args
             graph_str = ';'.join(graph)
             self._info('Filtergraph ready: "{}".'.format(graph_str))
-            exec_args = [self.conf.FFMPEG_PATH] + self.conf.FFMPEG_GLOBAL_ARGS + ['-i', self.layout[i]['source']] + \
-                        ['-filter_complex', graph_str, '-map', 'a:0', '-map', '[video_out]'] + \
-                        self.conf.FFMPEG_OUT_ARGS + [self.conf.FFMPEG_OUT_STR_BUILDER(i)]
-            self._info('Args: {}'.format(exec_args))
-            log_path = os.path.join(self.conf.LOG_DIR, 'monitor.source{}.log'.format(i))
-            self._info('Creating thread #{}...'.format(i))
-            ebur_stats_path = self.conf.EBUR_STATS_FILENAME_TPL.format(i)
-            thread = threading.Thread(
-                target=_ffmpeg_thread,
-                args=(exec_args, log_path, ebur_stats_path, audio_channel_ids )
+            # -y as the thumbnail FIFOs already exist when ffmpeg opens them
+            exec_args = [self.conf.FFMPEG_PATH] + self.conf.FFMPEG_GLOBAL_ARGS + ['-y'] * bool(thumbnail_args) + \
+                        ['-i', source] + ['-filter_complex', graph_str]
+            outputs = [self.conf.FFMPEG_OUT_STR_BUILDER(i) for i in frame_ids]
+            for (out_label, out_str) in zip(out_labels, outputs):
+                exec_args += ['-map', 'a:0', '-map', '[{}]'.format(out_label)] + self.conf.FFMPEG_OUT_ARGS + [out_str]
+            exec_args += thumbnail_args
+            processes.append({
+                'name': 'frame {}'.format(', '.join(map(str, frame_ids))),
+                'args': exec_args,
+                'outputs': outputs,
+                'pixel_rate': pixel_rate,
+                'log_path': os.path.join(self.conf.LOG_DIR, 'monitor.source{}.log'.format(frame_ids[0])),
+                'frames': [self._get_frame_stats(i, audio_channel_ids, '') for i in frame_ids],
+            })
+        return processes
+
+    def _get_mosaic_processes(self, sources_info):
+        # a single ffmpeg process composing every frame onto one canvas following the layout grid
+        cell_width = self.conf.MOSAIC_CELL_WIDTH
+        cell_height = self.conf.MOSAIC_CELL_HEIGHT
+        canvas_width = self.conf.LAYOUT_MAP_WIDTH * cell_width
+        canvas_height = self.layout_map_height * cell_height
+        self._info('Mosaic canvas size: {w}x{h}.'.format(w=canvas_width, h=canvas_height))
+        inputs = []
+        graph = []
+        tiles = []
+        frames = []
+        pixel_rates = []
+        thumbnail_args = []
+        for (source, frame_ids) in self._get_source_groups():
+            source_prefix = 's{}_'.format(len(inputs))
+            try:
+                source_graph, audio_channel_ids, out_labels, pixel_rate = self._get_source_graph(
+                    frame_ids, sources_info[source], ['f{}_'.format(i) for i in frame_ids], len(inputs), source_prefix
+                )
+            except FrameInputException as e:
+                self._warning('Frame(s) {} skipped: {}'.format(', '.join(map(str, frame_ids)), str(e)))
+                continue
+            inputs.append(source)
+            graph.extend(source_graph)
+            pixel_rates.append(pixel_rate)
+            for (i, out_label) in zip(frame_ids, out_labels):
+                f = self.layout[i]
+                out_label, chain, args = self._get_thumbnail_output(i, out_label)
+                graph.extend(chain)
+                thumbnail_args += args
+                tile_chain = "[{out}]scale=w={w}:h={h}:force_original_aspect_ratio=decrease," \
+                             "pad={w}:{h}:(ow-iw)/2:(oh-ih)/2[f{i}_tile]" \
+                             "".format(out=out_label, w=f['width'] * cell_width, h=f['height'] * cell_height, i=i)
+                self._info('Tile chain: "{}".'.format(tile_chain))
+                graph.append(tile_chain)
+                tiles.append(('f{}_tile'.format(i), f['x'] * cell_width, f['y'] * cell_height))
+                frames.append(self._get_frame_stats(i, audio_channel_ids, source_prefix))
+        if not tiles:
+            return []
+        chains = ["color=c=black:s={w}x{h}[mosaic_mid_0]".format(w=canvas_width, h=canvas_height)]
+        for (n, (tile, x, y)) in enumerate(tiles):
+            chains.append("[mosaic_mid_{n}][{tile}]overlay={x}:{y}[{out}]".format(
+                n=n, tile=tile, x=x, y=y,
+                out='mosaic_mid_{}'.format(n + 1) if (n + 1) < len(tiles) else 'mosaic_out'
+            ))
+        self._info('Mosaic chains: "{}".'.format(';'.join(chains)))
+        graph.extend(chains)
+        graph_str = ';'.join(graph)
+        self._info('Filtergraph ready: "{}".'.format(graph_str))
+        out_str = self.conf.MOSAIC_OUT_STR
+        if out_str is None:
+            out_str = self.conf.FFMPEG_OUT_STR_BUILDER('mosaic')
+        exec_args = [self.conf.FFMPEG_PATH] + self.conf.FFMPEG_GLOBAL_ARGS + ['-y'] * bool(thumbnail_args) + \
+                    [a for source in inputs for a in ('-i', source)] + \
+                    ['-filter_complex', graph_str, '-map', '[mosaic_out]'] + self.conf.FFMPEG_OUT_ARGS + [out_str] + \
+                    thumbnail_args
+        return [{
+            'name': 'mosaic',
+            'args': exec_args,
+            'outputs': [out_str],
+            # the canvas is rendered at the default rate of the color source
+            'pixel_rate': sum(pixel_rates) + canvas_width * canvas_height * DEFAULT_FRAME_RATE,
+            'log_path': os.path.join(self.conf.LOG_DIR, 'monitor.mosaic.log'),
+            'frames': frames,
+        }]
+
+    def _get_thumbnail_output(self, i, out_label):
+        # Splits a low-rate JPEG snapshot off a frame's output, written as an image stream into a FIFO the supervisor
+        # reads (see Supervisor._read_thumbnails). Returns (label to encode, chains, output args).
+        if self.conf.THUMBNAIL_SHM_TPL is None:
+            return out_label, [], []
+        chain = "[{out}]split=2[f{i}_encode_out][f{i}_thumb_in];" \
+                "[f{i}_thumb_in]fps=1/{interval},scale=-2:{h}[f{i}_thumb_out]" \
+                "".format(out=out_label, i=i, interval=self.conf.THUMBNAIL_INTERVAL, h=self.conf.THUMBNAIL_HEIGHT)
+        self._info('Thumbnail chains: "{}".'.format(chain))
+        args = ['-map', '[f{}_thumb_out]'.format(i), '-f', 'image2pipe', '-c:v', 'mjpeg',
+                '-q:v', str(self.conf.THUMBNAIL_QUALITY), '-flush_packets', '1',
+                self.conf.THUMBNAIL_SHM_TPL.format(i) + THUMBNAIL_FIFO_SUFFIX]
+        return 'f{}_encode_out'.format(i), [chain], args
+
+    def _get_frame_stats(self, i, audio_channel_ids, tag_prefix):
+        return {
+            'shm_path': self.conf.EBUR_STATS_SHM_TPL.format(i),
+            'stats_path': self.conf.EBUR_STATS_FILENAME_TPL.format(i)
+            if self.conf.EBUR_STATS_FILENAME_TPL is not None else None,
+            'history_path': self.conf.EBUR_HISTORY_SHM_TPL.format(i)
+            if self.conf.EBUR_HISTORY_SHM_TPL is not None else None,
+            'history_tiers': self.conf.EBUR_HISTORY_TIERS,
+            'thumbnail_path': self.conf.THUMBNAIL_SHM_TPL.format(i)
+            if self.conf.THUMBNAIL_SHM_TPL is not None else None,
+            'id': i,
+            'source': self.layout[i]['source'],
+            'name': self.layout[i]['name'],
+            'channel_ids': audio_channel_ids,
+            'tag_prefix': tag_prefix,
+        }
+
+    def _get_source_graph(self, frame_ids, source_info, frame_prefixes, input_id=0, source_prefix=''):
+        # Decodes and meters a source once and fans the result out to every frame showing it.
+        # Returns (graph, audio channel ids, [output label of every frame], pixel rate), the pixel rate (decoded and
+        # rendered pixels per second) estimates the CPU cost of the graph (see _plan_cpu_budget).
+        if isinstance(source_info, FrameInputException):
+            raise source_info
+        lead = self.layout[frame_ids[0]]
+        audio_streams = []
+        video_streams = []
+        for s in source_info['streams']:
+            if s['codec_type'] == 'video':
+                self._info('Source {} - found video stream #{}.'.format(frame_ids[0], s['index']))
+                video_streams.append(s)
+            elif s['codec_type'] == 'audio':
+                self._info('Source {} - found audio stream #{}.'.format(frame_ids[0], s['index']))
+                audio_streams.append(s)
+        if not video_streams:
+            raise FrameInputException('source "{}" has no video streams.'.format(lead['source']))
+        graph, meter_ratio, audio_channel_ids = self._get_meter_graph(
+            audio_streams, lead['meter_channel_font'], lead['meter_channel_font_size'], input_id, source_prefix
+        )
+        video_label = '{}:v:0'.format(input_id)
+        meters_label = '{}all_meters_out'.format(source_prefix)
+        if len(frame_ids) == 1:
+            video_labels = [video_label]
+            meters_labels = [meters_label]
+        else:
+            self._info('Splitting source between frames {}...'.format(', '.join(map(str, frame_ids))))
+            video_labels = ['{}video_in'.format(p) for p in frame_prefixes]
+            meters_labels = ['{}meters_in'.format(p) for p in frame_prefixes]
+            split_chain = "[{video}]split={n}{video_outs};[{meters}]split={n}{meters_outs}".format(
+                video=video_label, meters=meters_label, n=len(frame_ids),
+                video_outs=''.join('[{}]'.format(l) for l in video_labels),
+                meters_outs=''.join('[{}]'.format(l) for l in meters_labels)
             )
-            ffmpeg_threads.append(thread)
-        self._info('Starting ffmpeg threads...')
-        for i, t in enumerate(ffmpeg_threads):
-            t.start()
-            self._log('ffmpeg thread #{} started.'.format(i))
+            self._info('Split chains: "{}".'.format(split_chain))
+            graph.append(split_chain)
+        out_labels = []
+        vs = video_streams[0]
+        pixels = SOURCE_DECODE_WEIGHT * vs['width'] * vs['height']
+        for (i, p, v, m) in zip(frame_ids, frame_prefixes, video_labels, meters_labels):
+            frame_graph, out_label, (width, height) = self._get_frame_graph(i, vs, meter_ratio, v, m, p)
+            graph.extend(frame_graph)
+            out_labels.append(out_label)
+            pixels += width * height
+        return graph, audio_channel_ids, out_labels, pixels * self._get_frame_rate(vs)
+
+    def _get_frame_rate(self, vs):
+        try:
+            num, den = str(vs.get('avg_frame_rate', '0/0')).split('/')
+            rate = float(num) / float(den)
+        except (ValueError, ZeroDivisionError):
+            rate = 0
+        if not 0 < rate <= 300:
+            self._warning('Frame rate of video stream #{} is unknown - assuming {} fps.'.format(
+                vs['index'], DEFAULT_FRAME_RATE
+            ))
+            rate = DEFAULT_FRAME_RATE
+        return rate
+
+    def _get_frame_graph(self, i, vs, meter_ratio, video_label, meters_label, prefix=''):
+        # scales the source video and meters to the frame size, returns (graph, output label, (width, height))
+        graph = []
+        video_height = self.layout[i]['video_height']
+        self._info('Scaling source video...')
+        try:
+            l, r = str(vs['sample_aspect_ratio']).split(':')
+        except ValueError:
+            self._warning('SAR error - using SAR = 1.')
+            sar = 1
+        else:
+            sar = float(l) / float(r)
+            self._info('Source SAR = {}.'.format(sar))
+        eff_source_video_width = math.trunc(vs['width'] * sar)
+        source_video_height = vs['height']
+        scale_factor = video_height / source_video_height
+        self._info('Scale factor: {}.'.format(scale_factor))
+        video_width = math.trunc(eff_source_video_width * scale_factor)
+        self._info('Scaled video size: {w}x{h}.'.format(w=video_width, h=video_height))
+        scale_chain = "[{video}]scale={w}:{h},setsar=sar=1[{p}scaled_video]" \
+                      "".format(video=video_label, w=video_width, h=video_height, p=prefix)
+        graph.append(scale_chain)
+        self._info('Drawing border...')
+        border_width = 2
+        border_color = '0x00FF00'
+        border_chain = "color=c={border_color}:s={w}x{h}[{p}border_bg];" \
+                       "[{p}border_bg][{p}scaled_video]overlay={bw}:{bw}[{p}bordered_video]" \
+                       "".format(border_color=border_color, w=border_width * 2 + video_width,
+                                 h=border_width * 2 + video_height, bw=border_width, p=prefix)
+        self._info('Border chains: "{}".'.format(border_chain))
+        graph.append(border_chain)
+        self._info('Scale chain: "{}".'.format(scale_chain))
+        self._info('Calculating audio meter size...')
+        self._info('Audio meter ratio: {}.'.format(meter_ratio))
+        meter_width = math.trunc(video_height * meter_ratio)
+        meter_height = border_width * 2 + video_height
+        self._info('Scaled audio meter size: {w}x{h}.'.format(w=meter_width, h=video_height))
+        meter_scale_chain = "[{meters}]scale=w={w}:h={h}[{p}scaled_meters]" \
+                            "".format(meters=meters_label, w=meter_width, h=meter_height, p=prefix)
+        self._info('Audio meter scale chain: "{}".'.format(meter_scale_chain))
+        graph.append(meter_scale_chain)
+        total_width = border_width * 2 + video_width + 2 + meter_width
+        total_height = meter_height
+        chain = "color=c=black:s={bg_width}x{bg_height}[{p}main_bg];" \
+                "[{p}main_bg][{p}scaled_meters]overlay={meters_x_offset}:0[{p}main_mid_0];" \
+                "[{p}main_mid_0][{p}bordered_video]overlay=0:0[{p}video_out]" \
+                "".format(bg_width=total_width, bg_height=total_height,
+                          meters_x_offset=border_width * 2 + video_width + 2, p=prefix)
+        self._info('Overlay chains: "{}".'.format(chain))
+        graph.append(chain)
+        return graph, '{}video_out'.format(prefix), (total_width, total_height)
 
-    def _get_meter_graph(self, audio_streams, channel_label_font, channel_label_font_size):
+    def _get_meter_graph(self, audio_streams, channel_label_font, channel_label_font_size, input_id=0, prefix=''):
+        # prefix namespaces every link label so several meter graphs can share a filtergraph
         self._info('Building audio meter graph...')
         graph = []
         # scale
@@ -221,28 +2101,36 @@ class Application:
         scale_x = 8
         scale_y = 22
         self._info('Drawing scale...')
-        scale_graph = "anullsrc, ebur128=video=1:meter=18[ebur_nullsrc],anullsink;" \
-                      "[ebur_nullsrc]crop={w}:{h}:{x}:{y}[ebur_scale]" \
-                      "".format(w=scale_width, h=scale_height, x=scale_x, y=scale_y)
+        scale_graph = "anullsrc, ebur128=video=1:meter=18[{p}ebur_nullsrc],anullsink;" \
+                      "[{p}ebur_nullsrc]crop={w}:{h}:{x}:{y}[{p}ebur_scale]" \
+                      "".format(p=prefix, w=scale_width, h=scale_height, x=scale_x, y=scale_y)
         self._info('Scale chains: "{}".'.format(scale_graph))
         graph.append(scale_graph)
         audio_in_chains = []
         audio_splitted_channels = []
+        # ebur128 attaches its values to every audio frame, frames are regrouped to 100 ms to match its update rate
+        channel_frame_samples = {}
         self._info('Splitting audio channels...')
         for s in audio_streams:
+            try:
+                frame_samples = int(s['sample_rate']) // 10
+            except (KeyError, ValueError):
+                frame_samples = 4800
             if s['channels'] == 1:
-                audio_in_chains.append("[0:{s_id}]anull[{output_name}]".format(
-                    s_id=s['index'], output_name="audio_in_{}_0".format(s['index'])
+                audio_in_chains.append("[{input_id}:{s_id}]anull[{p}audio_in_{s_id}_0]".format(
+                    input_id=input_id, s_id=s['index'], p=prefix
                 ))
                 audio_splitted_channels.append("{}_0".format(s['index']))
+                channel_frame_samples["{}_0".format(s['index'])] = frame_samples
             else:
                 splitted_outputs = ["{}_{}".format(s['index'], ch_id) for ch_id in range(0, s['channels'])]
-                chain = "[0:{s_id}]channelsplit=channel_layout={ch_layout}{outputs}".format(
-                    s_id=s['index'], ch_layout=s['channel_layout'],
-                    outputs=''.join(["[audio_in_{}]".format(o) for o in splitted_outputs])
+                chain = "[{input_id}:{s_id}]channelsplit=channel_layout={ch_layout}{outputs}".format(
+                    input_id=input_id, s_id=s['index'], ch_layout=s['channel_layout'],
+                    outputs=''.join(["[{}audio_in_{}]".format(prefix, o) for o in splitted_outputs])
                 )
                 audio_in_chains.append(chain)
                 audio_splitted_channels.extend(splitted_outputs)
+                channel_frame_samples.update({o: frame_samples for o in splitted_outputs})
         self._info('Audio inputs chains: "{}".'.format(';'.join(audio_in_chains)))
         graph.extend(audio_in_chains)
         audio_meter_chains = []
@@ -255,13 +2143,17 @@ class Application:
         meter_label_y_offset = 4
         self._info('Drawing audio meters...')
         for c in audio_splitted_channels:
-            chain = "color=c=black:s={meter_width}x{scale_height}[meter_bg_{ch}];" \
-                    "[audio_in_{ch}]ebur128=meter=18:video=1:framelog=info[ebur_{ch}], anullsink;" \
-                    "[ebur_{ch}]crop={meter_crop_width}:{meter_crop_height}:{meter_x}:{meter_y}[ebur_crop_{ch}];" \
-                    "[meter_bg_{ch}][ebur_crop_{ch}]overlay=0:{meter_y_offset}," \
+            chain = "color=c=black:s={meter_width}x{scale_height}[{p}meter_bg_{ch}];" \
+                    "[{p}audio_in_{ch}]asetnsamples=n={frame_samples}:p=0,ebur128=meter=18:video=1:metadata=1" \
+                    "[{p}ebur_{ch}],ametadata=mode=add:key={tag}:value={p}{ch}," \
+                    "ametadata=mode=print:file='{metadata_out}':direct=1,anullsink;" \
+                    "[{p}ebur_{ch}]crop={meter_crop_width}:{meter_crop_height}:{meter_x}:{meter_y}[{p}ebur_crop_{ch}];" \
+                    "[{p}meter_bg_{ch}][{p}ebur_crop_{ch}]overlay=0:{meter_y_offset}," \
                     "drawtext=fontcolor=0xF0F0F0:fontfile='{font}':fontsize={fontsize}:text='{text}':" \
-                    "x=0:y={meter_label_y_offset}[meter_{ch}]" \
-                    "".format(ch=c, font=self._escape_str(channel_label_font), fontsize=channel_label_font_size,
+                    "x=0:y={meter_label_y_offset}[{p}meter_{ch}]" \
+                    "".format(p=prefix, ch=c, frame_samples=channel_frame_samples[c], tag=EBUR_CHANNEL_TAG,
+                              metadata_out=self._escape_str('pipe:1'),
+                              font=self._escape_str(channel_label_font), fontsize=channel_label_font_size,
                               text=c.replace('_', r'\:'), meter_width=meter_width, scale_height=scale_height,
                               meter_crop_width=meter_crop_width, meter_crop_height=meter_crop_height, meter_x=meter_x,
                               meter_y=meter_y, meter_y_offset=meter_y_offset, meter_label_y_offset=meter_label_y_offset)
@@ -271,15 +2163,15 @@ class Application:
         total_meters_width = scale_width + 2 + len(audio_meter_chains) * meter_width
         meters_ratio = total_meters_width / scale_height
         self._info('Combining audio meters...')
-        bg_chain = "color=c=black:s={total_meters_width}x{scale_height}[all_meters_bg];" \
-                   "[all_meters_bg][ebur_scale]overlay=0:0[all_meters_mid_0]" \
-                   "".format(total_meters_width=total_meters_width, scale_height=scale_height)
+        bg_chain = "color=c=black:s={total_meters_width}x{scale_height}[{p}all_meters_bg];" \
+                   "[{p}all_meters_bg][{p}ebur_scale]overlay=0:0[{p}all_meters_mid_0]" \
+                   "".format(p=prefix, total_meters_width=total_meters_width, scale_height=scale_height)
         self._info('Audio meters background chains: "{}".'.format(bg_chain))
         overlay_chains = [bg_chain]
         total_meters = len(audio_splitted_channels)
         for i, c in enumerate(audio_splitted_channels):
-            chain = "[all_meters_mid_{i}][meter_{ch}]overlay={x}:0[{out}]" \
-                    "".format(i=i, ch=c, x=scale_width + 2 + i * meter_width,
+            chain = "[{p}all_meters_mid_{i}][{p}meter_{ch}]overlay={x}:0[{p}{out}]" \
+                    "".format(p=prefix, i=i, ch=c, x=scale_width + 2 + i * meter_width,
                               out='all_meters_mid_{next_i}'.format(next_i=i + 1)
                               if (i + 1) < total_meters else 'all_meters_out')
             overlay_chains.append(chain)
@@ -297,7 +2189,7 @@ class Application:
         required_parameters = {
             'BASE_DIR': str, 'FFMPEG_PATH': str, 'FFMPEG_GLOBAL_ARGS': list, 'FFPROBE_PATH': str, 'FFPROBE_ARGS': list,
             'FFPROBE_TIMEOUT': int, 'STATIC_DIR': str, 'LAYOUT_MAP_WIDTH': int, 'FFMPEG_OUT_ARGS': list,
-            'FFMPEG_OUT_STR_BUILDER': None, 'EBUR_STATS_FILENAME_TPL': str, 'LOG_DIR': str
+            'FFMPEG_OUT_STR_BUILDER': None, 'LOG_DIR': str
         }
         for (p, t) in required_parameters.items():
             try:
@@ -306,37 +2198,100 @@ class Application:
                 raise ConfException('Required parameter is missing: "{}".'.format(p))
             if t is not None and type(param_value) != t:
                 raise ConfException('Parameter "{}" must be a {} - {} given.'.format(p, t, type(param_value)))
+        for (p, (types, _)) in OPTIONAL_PARAMETERS.items():
+            param_value = getattr(self.conf, p)
+            if type(param_value) not in types:
+                raise ConfException('Parameter "{}" must be one of {} - {} given.'.format(
+                    p, ', '.join(map(str, types)), type(param_value)
+                ))
+        for p in ('PROBE_WORKERS', 'LOG_FLUSH_INTERVAL', 'LOG_FLUSH_SIZE', 'LOG_MAX_BYTES', 'MOSAIC_CELL_WIDTH',
+                  'MOSAIC_CELL_HEIGHT', 'SUPERVISOR_BACKOFF_MIN', 'SUPERVISOR_BACKOFF_MAX', 'SUPERVISOR_STOP_TIMEOUT',
+                  'ALARM_INTERVAL', 'CPU_CORE_PIXEL_RATE', 'METRICS_INTERVAL', 'SUPERVISOR_LAUNCH_BURST',
+                  'THUMBNAIL_INTERVAL', 'THUMBNAIL_HEIGHT', 'WEB_PORT', 'CLUSTER_REPORT_INTERVAL'):
+            if getattr(self.conf, p) <= 0:
+                raise ConfException('Parameter "{}" must be positive.'.format(p))
+        for p in ('SUPERVISOR_LAUNCH_RATE', 'SUPERVISOR_MAX_STARTING', 'STATIC_MAX_AGE', 'CLUSTER_REBALANCE_DELAY',
+                  'SUPERVISOR_HUNG_TIMEOUT', 'PROBE_RETRY_INTERVAL'):
+            if getattr(self.conf, p) < 0:
+                raise ConfException('Parameter "{}" must not be negative.'.format(p))
+        tiers = self.conf.EBUR_HISTORY_TIERS
+        if not tiers or any(
+            type(t) not in (list, tuple) or len(t) != 2 or type(t[0]) not in (int, float) or type(t[1]) != int or
+            t[0] <= 0 or t[1] <= 0 for t in tiers
+        ):
+            raise ConfException(
+                'Parameter "EBUR_HISTORY_TIERS" must be a non-empty list of [resolution, capacity] pairs of positive '
+                'numbers.'
+            )
+        if self.conf.CLUSTER_WORKER_TIMEOUT <= 2 * self.conf.CLUSTER_REPORT_INTERVAL:
+            # workers stop their frames after half of the timeout without word from the coordinator
+            raise ConfException(
+                'Parameter "CLUSTER_WORKER_TIMEOUT" must be greater than twice "CLUSTER_REPORT_INTERVAL".'
+            )
+        if self.conf.THUMBNAIL_SHM_TPL is not None and not hasattr(os, 'mkfifo'):
+            raise ConfException('Parameter "THUMBNAIL_SHM_TPL" must be None on this platform (no FIFO support).')
+        if not 2 <= self.conf.THUMBNAIL_QUALITY <= 31:
+            raise ConfException('Parameter "THUMBNAIL_QUALITY" must be between 2 and 31.')
+        self._alarm_rules_check(self.conf.ALARM_RULES)
+        if self.conf.CPU_BUDGET_CORES is not None and (
+            not self.conf.CPU_BUDGET_CORES or any(type(c) != int or c < 0 for c in self.conf.CPU_BUDGET_CORES)
+        ):
+            raise ConfException('Parameter "CPU_BUDGET_CORES" must be a non-empty list of CPU numbers.')
         # checking dir existence
         self._check_dir_existence({
             'BASE_DIR': self.conf.BASE_DIR,
             'STATIC_DIR': self.conf.STATIC_DIR,
             'LOG_DIR': self.conf.LOG_DIR,
+            'EBUR_STATS_SHM_TPL (directory)': os.path.dirname(self.conf.EBUR_STATS_SHM_TPL) or '.',
         })
+        if self.conf.METRICS_PATH is not None:
+            self._check_dir_existence({
+                'METRICS_PATH (directory)': os.path.dirname(self.conf.METRICS_PATH) or '.',
+            })
+        if self.conf.ALARM_STATE_PATH is not None:
+            self._check_dir_existence({
+                'ALARM_STATE_PATH (directory)': os.path.dirname(self.conf.ALARM_STATE_PATH) or '.',
+            })
+        if self.conf.EBUR_HISTORY_SHM_TPL is not None:
+            self._check_dir_existence({
+                'EBUR_HISTORY_SHM_TPL (directory)': os.path.dirname(self.conf.EBUR_HISTORY_SHM_TPL) or '.',
+            })
+        if self.conf.CLUSTER_STATE_PATH is not None:
+            self._check_dir_existence({
+                'CLUSTER_STATE_PATH (directory)': os.path.dirname(self.conf.CLUSTER_STATE_PATH) or '.',
+            })
+        if self.conf.THUMBNAIL_SHM_TPL is not None:
+            self._check_dir_existence({
+                'THUMBNAIL_SHM_TPL (directory)': os.path.dirname(self.conf.THUMBNAIL_SHM_TPL) or '.',
+            })
         # checking file existence
         self._check_file_existence({
             'FFMPEG_PATH': self.conf.FFMPEG_PATH,
             'FFPROBE_PATH': self.conf.FFPROBE_PATH,
         })
-        # checking file execution
-        # tuple format: (ARGS, TIMEOUT, CALLBACK, CB_ERR_TEXT)
-        self._check_file_execution({
-            'FFMPEG_PATH': (
-                [self.conf.FFMPEG_PATH, '-version'], 1, lambda x: x.startswith('ffmpeg version'),
-                'FFMPEG_PATH ("{}") is not a ffmpeg executable.'.format(self.conf.FFMPEG_PATH)
-            ),
-            'FFPROBE_PATH': (
-                [self.conf.FFPROBE_PATH, '-version'], 1, lambda x: x.startswith('ffprobe version'),
-                'FFPROBE_PATH ("{}") is not a ffprobe executable.'.format(self.conf.FFPROBE_PATH)
-            )
-        })
-        # checking log directory
-        tmp_file_path = os.path.join(self.conf.LOG_DIR, 'monitor.tmp')
+        # checking executables, their capabilities are cached until the binaries change
+        cache = FileCache(self.conf.CAPABILITY_CACHE_PATH, max_entries=CAPABILITY_CACHE_ENTRIES)
+        self.capabilities = {
+            'ffmpeg': self._get_capabilities('FFMPEG_PATH', self.conf.FFMPEG_PATH, 'ffmpeg', cache),
+            'ffprobe': self._get_capabilities('FFPROBE_PATH', self.conf.FFPROBE_PATH, 'ffprobe', cache),
+        }
         try:
-            open(tmp_file_path, 'w')
+            cache.save()
         except OSError as e:
-            raise ConfException('Log directory check failed: {}.'.format(str(e)))
-        else:
-            os.remove(tmp_file_path)
+            self._warning('Failed to save capability cache: {}.'.format(str(e)))
+        missing_filters = [f for f in REQUIRED_FILTERS if f not in self.capabilities['ffmpeg']['filters']]
+        if missing_filters:
+            raise ConfException('FFMPEG_PATH ("{}") lacks required filters: {}.'.format(
+                self.conf.FFMPEG_PATH, ', '.join(missing_filters)
+            ))
+        for (f, (options, release)) in REQUIRED_FILTER_OPTIONS.items():
+            missing_options = [o for o in options if o not in self.capabilities['ffmpeg']['filter_options'][f]]
+            if missing_options:
+                raise ConfException('FFMPEG_PATH ("{}") lacks options of the {} filter: {} - ffmpeg {} or newer is '
+                                    'required.'.format(self.conf.FFMPEG_PATH, f, ', '.join(missing_options), release))
+        # checking log directory
+        if not os.access(self.conf.LOG_DIR, os.W_OK | os.X_OK):
+            raise ConfException('Log directory check failed: "{}" is not writable.'.format(self.conf.LOG_DIR))
 
     @staticmethod
     def _check_file_existence(file_dict):
@@ -344,6 +2299,44 @@ class Application:
             if not os.path.isfile(path):
                 raise ConfException('{} ("{}") is not an existing file.'.format(conf_param, path))
 
+    @staticmethod
+    def _alarm_rules_check(rules):
+        names = set()
+        for rule in rules:
+            if type(rule) != dict or type(rule.get('name')) != str or not rule['name']:
+                raise ConfException('Every alarm rule must be a dict with a "name".')
+            if rule['name'] in names:
+                raise ConfException('Alarm rule "{}" is defined twice.'.format(rule['name']))
+            names.add(rule['name'])
+            unknown = set(rule) - {'name', 'metric', 'above', 'below', 'clear', 'for', 'frames', 'channels'}
+            if unknown:
+                raise ConfException('Alarm rule "{}" has unknown parameters: {}.'.format(
+                    rule['name'], ', '.join(sorted(unknown))
+                ))
+            if rule.get('metric') not in AlarmEngine.METRICS:
+                raise ConfException('Alarm rule "{}" must have a metric, one of: {}.'.format(
+                    rule['name'], ', '.join(AlarmEngine.METRICS)
+                ))
+            if ('above' in rule) == ('below' in rule):
+                raise ConfException('Alarm rule "{}" must have either an "above" or a "below" threshold.'.format(
+                    rule['name']
+                ))
+            threshold = rule['above'] if 'above' in rule else rule['below']
+            clear = rule.get('clear', threshold)
+            if any(type(v) not in (int, float) for v in (threshold, clear, rule.get('for', 0))) or \
+                    rule.get('for', 0) < 0:
+                raise ConfException('Alarm rule "{}" thresholds and duration must be numbers (duration >= 0).'.format(
+                    rule['name']
+                ))
+            if ('above' in rule and clear > threshold) or ('below' in rule and clear < threshold):
+                raise ConfException('Alarm rule "{}" clear level must be on the other side of the threshold.'.format(
+                    rule['name']
+                ))
+            if type(rule.get('frames', [])) != list or any(type(i) != int for i in rule.get('frames', [])) or \
+                    type(rule.get('channels', [])) != list or any(type(c) != str for c in rule.get('channels', [])):
+                raise ConfException('Alarm rule "{}" frames must be a list of frame ids and channels a list of '
+                                    'channel ids ("<stream index>:<channel>").'.format(rule['name']))
+
     @staticmethod
     def _check_dir_existence(dir_dict):
         for (conf_param, path) in dir_dict.items():
@@ -351,17 +2344,55 @@ class Application:
                 raise ConfException('{} ("{}") is not an existing directory.'.format(conf_param, path))
 
     @staticmethod
-    def _check_file_execution(file_dict):
-        for (conf_param, check_tuple) in file_dict.items():
-            args, timeout, callback, cb_err_text = check_tuple
-            try:
-                o = subprocess.check_output(args, universal_newlines=True, timeout=timeout, stderr=subprocess.DEVNULL)
-                if not callback(o):
-                    raise ConfException(cb_err_text)
-            except subprocess.TimeoutExpired:
-                raise ConfException('{} ("{}") check timeout expired.'.format(conf_param, args[0]))
-            except OSError as e:
-                raise ConfException('{} ("{}") error: {}'.format(conf_param, args[0], str(e)))
+    def _check_file_execution(conf_param, args, timeout):
+        # returns the output of a check run of an executable
+        try:
+            return subprocess.check_output(args, universal_newlines=True, timeout=timeout, stderr=subprocess.DEVNULL)
+        except subprocess.TimeoutExpired:
+            raise ConfException('{} ("{}") check timeout expired.'.format(conf_param, args[0]))
+        except subprocess.CalledProcessError as e:
+            raise ConfException('{} ("{}") check failed with code {}.'.format(conf_param, args[0], e.returncode))
+        except OSError as e:
+            raise ConfException('{} ("{}") error: {}'.format(conf_param, args[0], str(e)))
+
+    def _get_capabilities(self, conf_param, path, name, cache):
+        # returns {'version': first line of -version, 'filters': [names], 'filter_options': {filter: [option names]}}
+        # (no filters for ffprobe, options of REQUIRED_FILTER_OPTIONS filters only), keyed in the cache by the binary
+        # path, mtime and size
+        st = os.stat(path)
+        cache_key = '{}:{}:{}:{}:{}'.format(
+            name, CAPABILITY_MANIFEST_VERSION, os.path.realpath(path), st.st_mtime_ns, st.st_size
+        )
+        capabilities = cache.get(cache_key)
+        if capabilities is not None:
+            self._info('Using cached {} capabilities.'.format(name))
+            return capabilities
+        version = self._check_file_execution(conf_param, [path, '-version'], 1)
+        if not version.startswith('{} version'.format(name)):
+            raise ConfException('{} ("{}") is not a {} executable.'.format(conf_param, path, name))
+        capabilities = {'version': version.split('\n')[0], 'filters': [], 'filter_options': {}}
+        if name == 'ffmpeg':
+            # filter lines look like " T.C ebur128           A->N       EBU R128 scanner."
+            for line in self._check_file_execution(conf_param, [path, '-hide_banner', '-filters'], 5).split('\n'):
+                fields = line.split()
+                if len(fields) >= 3 and '->' in fields[2]:
+                    capabilities['filters'].append(fields[1])
+            for f in REQUIRED_FILTER_OPTIONS:
+                if f not in capabilities['filters']:
+                    continue
+                # option lines look like "  direct            <boolean>    ..F.A...... reduce buffering when ...",
+                # their constants have a value instead of a <type>
+                options = []
+                for line in self._check_file_execution(
+                    conf_param, [path, '-hide_banner', '-h', 'filter={}'.format(f)], 5
+                ).split('\n'):
+                    fields = line.split()
+                    if len(fields) >= 2 and fields[1].startswith('<'):
+                        options.append(fields[0])
+                capabilities['filter_options'][f] = options
+        self._info('Found {}.'.format(capabilities['version']))
+        cache.put(cache_key, capabilities)
+        return capabilities
 
     def _layout_check(self):
         self._info('Checking layout...')
@@ -371,6 +2402,7 @@ class Application:
         layout_path = self.args.layout
         if not os.path.isabs(layout_path):
             layout_path = os.path.normpath(os.path.join(self.conf.BASE_DIR, layout_path))
+        self.layout_path = layout_path
         self._info('Loading layout file "{}"...'.format(layout_path))
         if not os.path.isfile(layout_path):
             raise LayoutException(
@@ -378,8 +2410,33 @@ class Application:
                 '(provided): "{}", (normalized): "{}".'.format(self.args.layout, layout_path)
             )
         try:
-            with open(layout_path) as layout_file:
-                layout = json.load(layout_file)
+            with open(layout_path, 'rb') as layout_file:
+                layout_data = layout_file.read()
+        except OSError as e:
+            raise LayoutException('Layout file "{}" could not be read: {}'.format(layout_path, str(e)))
+        # a compiled layout only depends on the file content and the map width
+        cache = self.layout_cache
+        cache_key = '{}:{}:{}'.format(
+            LAYOUT_COMPILER_VERSION, self.conf.LAYOUT_MAP_WIDTH, hashlib.sha256(layout_data).hexdigest()
+        )
+        compiled = cache.get(cache_key)
+        if compiled is not None:
+            self._info('Using compiled layout from cache.')
+        else:
+            compiled = self._compile_layout(layout_path, layout_data)
+            cache.put(cache_key, compiled)
+            try:
+                cache.save()
+            except OSError as e:
+                self._warning('Failed to save layout cache: {}.'.format(str(e)))
+        self.layout = compiled['frames']
+        self.layout_map_height = compiled['map_height']
+        if self.verbosity >= 2:
+            self._print_layout_map()
+
+    def _compile_layout(self, layout_path, layout_data):
+        try:
+            layout = json.loads(layout_data.decode())
         except ValueError as f:
             raise LayoutException('Layout file "{}" is not a valid JSON document: {}'.format(layout_path, str(f)))
         self._info('Checking layout file...')
@@ -398,31 +2455,66 @@ class Application:
                                       '- {} given (frame {})'.format(type(f), i))
             if not required_frame_parameters.issubset(f.keys()):
                 raise LayoutException('Frame\'s description must include {} (frame {}).'.format(
-                    ', '.join(sorted(required_frame_parameters))), i
-                )
+                    ', '.join(sorted(required_frame_parameters)), i
+                ))
             for (p, t) in frame_parameters_types.items():
                 if type(f.get(p)) != t:
                     raise LayoutException('Frame\'s parameter "{}" must be a {} - {} given (frame {}).'.format(
                         p, t, type(f.get(p)), i
                     ))
+            if f['x'] < 0 or f['y'] < 0 or f['width'] <= 0 or f['height'] <= 0:
+                raise LayoutException('Frame\'s position must be non-negative and its size positive (frame {}).'.format(i))
             if (f['x'] + f['width']) > self.conf.LAYOUT_MAP_WIDTH:
                 raise LayoutException('Frame\'s width exceeds layout map width (frame {})'.format(i))
             map_height = max(map_height, f['y'] + f['height'])
             if f['video_height'] <= 0:
                 raise LayoutException('Video height must be a positive integer.')
-        layout_map = [['.' for y in range(0, map_height)] for x in range(0, self.conf.LAYOUT_MAP_WIDTH)]
-        for (i, f) in enumerate(layout):
-            occupied_by_frame = [(x, y) for x in range(f['x'], f['x'] + f['width'])
-                                 for y in range(f['y'], f['y'] + f['height'])]
-            for (x, y) in occupied_by_frame:
-                if layout_map[x][y] != '.':
-                    raise LayoutException('Frame intersection detected (({}, {}), frame {}).'.format(x, y, i))
-                else:
-                    layout_map[x][y] = str(i)
+        intersection = self._find_intersection(layout)
+        if intersection is not None:
+            raise LayoutException('Frame intersection detected (({}, {}), frame {}).'.format(*intersection))
+        self._info('Layout check complete.')
+        return {'frames': layout, 'map_height': map_height}
+
+    @staticmethod
+    def _find_intersection(layout):
+        # Sweeps the frames top to bottom. Frames crossing the sweep line have pairwise disjoint column intervals,
+        # kept sorted by their start, so a new frame only has to be compared with its two neighbours: O(n log n)
+        # comparisons regardless of the grid size. Returns (x, y, frame) of an overlapping cell or None.
+        order = sorted(range(len(layout)), key=lambda i: (layout[i]['y'], layout[i]['x']))
+        active_starts = []  # column starts of the frames crossing the sweep line
+        active = []  # frame indices, parallel to active_starts
+        retiring = []  # heap of (bottom edge, frame index)
+        for i in order:
+            f = layout[i]
+            while retiring and retiring[0][0] <= f['y']:
+                _, j = heapq.heappop(retiring)
+                pos = bisect.bisect_left(active_starts, layout[j]['x'])
+                del active_starts[pos]
+                del active[pos]
+            pos = bisect.bisect_left(active_starts, f['x'])
+            for k in (pos - 1, pos):
+                if 0 <= k < len(active):
+                    g = layout[active[k]]
+                    if g['x'] < f['x'] + f['width'] and f['x'] < g['x'] + g['width']:
+                        return max(f['x'], g['x']), max(f['y'], g['y']), max(i, active[k])
+            active_starts.insert(pos, f['x'])
+            active.insert(pos, i)
+            heapq.heappush(retiring, (f['y'] + f['height'], i))
+        return None
+
+    def _print_layout_map(self):
+        if self.conf.LAYOUT_MAP_WIDTH * self.layout_map_height > LAYOUT_MAP_PRINT_CELLS:
+            self._info('Layout frames:')
+            for (i, f) in enumerate(self.layout):
+                self._info('{}: ({}, {}) {}x{} "{}"'.format(i, f['x'], f['y'], f['width'], f['height'], f['name']))
+            return
+        layout_map = [['.'] * self.conf.LAYOUT_MAP_WIDTH for y in range(0, self.layout_map_height)]
+        for (i, f) in enumerate(self.layout):
+            for y in range(f['y'], f['y'] + f['height']):
+                layout_map[y][f['x']:f['x'] + f['width']] = [str(i)] * f['width']
         self._info('Layout map building complete:')
-        for y in range(0, map_height):
-            self._info(' '.join([layout_map[x][y] for x in range(0, self.conf.LAYOUT_MAP_WIDTH)]))
-        self.layout = layout
+        for row in layout_map:
+            self._info(' '.join(row))
 
     def _get_source_info(self, input_path):
         self._info('Trying to fetch source info: "{}"...'.format(input_path))
@@ -433,7 +2525,102 @@ class Application:
             )
         except subprocess.TimeoutExpired:
             raise FrameInputException('Failed to fetch info from "{}" - timeout expired.'.format(input_path))
-        return {'streams': json.loads(o)['streams']}
+        except subprocess.CalledProcessError as e:
+            raise FrameInputException('Failed to fetch info from "{}" - ffprobe exited with code {}.'.format(
+                input_path, e.returncode
+            ))
+        except OSError as e:
+            raise FrameInputException('Failed to fetch info from "{}": {}'.format(input_path, str(e)))
+        try:
+            return {'streams': json.loads(o)['streams']}
+        except (ValueError, KeyError):
+            raise FrameInputException('Failed to fetch info from "{}" - malformed ffprobe output.'.format(input_path))
+
+    def _get_timed_source_info(self, input_path):
+        started = time.perf_counter()
+        try:
+            return self._get_source_info(input_path)
+        except FrameInputException:
+            self.metrics.inc('monitor_probe_failures_total', {})
+            raise
+        finally:
+            self.metrics.observe('monitor_probe_duration_seconds', {}, time.perf_counter() - started)
+
+    def _refresh_source_info(self, sources):
+        # called by the supervisor when ffmpeg exited before any EBUR metadata: a cached probe may be stale (e.g. the
+        # streams of a source changed), so it is dropped and probed again, returns whether any info changed. A source
+        # that can not be probed either keeps its cached info: it is most likely down and the process retries anyway.
+        if self.probe_cache is None:
+            return False
+        dropped = {}
+        for source in sources:
+            info = self.probe_cache.remove(source)
+            if info is not None:
+                dropped[source] = info
+        if not dropped:
+            return False
+        self._info('Dropped cached info of {} source(s) after a failed start.'.format(len(dropped)))
+        probed = self._probe_sources(list(dropped))
+        changed = False
+        for (source, info) in dropped.items():
+            if isinstance(probed[source], FrameInputException):
+                self.probe_cache.put(source, info)
+            elif probed[source] != info:
+                changed = True
+        return changed
+
+    def _probe_skipped_sources(self):
+        # returns whether any source skipped by the last _get_processes can be probed now
+        if not self.skipped_sources:
+            return False
+        probed = self._probe_sources(sorted(self.skipped_sources))
+        recovered = [s for (s, info) in probed.items() if not isinstance(info, FrameInputException)]
+        if recovered:
+            self._info('{} skipped source(s) can be probed again.'.format(len(recovered)))
+        return bool(recovered)
+
+    async def _retry_skipped_sources(self, supervisor):
+        # supervisor task: the frames of a source that was down when probed are started once it is back
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.conf.PROBE_RETRY_INTERVAL)
+            if await loop.run_in_executor(None, self._probe_skipped_sources):
+                supervisor.request_reload()
+
+    def _probe_sources(self, sources):
+        # returns {source: info or FrameInputException}, every distinct source is probed once
+        if self.probe_cache is None:
+            self.probe_cache = FileCache(self.conf.PROBE_CACHE_PATH, self.conf.PROBE_CACHE_TTL)
+        cache = self.probe_cache
+        result = {}
+        to_probe = []
+        for source in sources:
+            if source in result or source in to_probe:
+                continue
+            info = cache.get(source)
+            if info is not None:
+                self._info('Using cached source info: "{}".'.format(source))
+                result[source] = info
+            else:
+                to_probe.append(source)
+        if to_probe:
+            self._info('Probing {} source(s) with {} worker(s)...'.format(
+                len(to_probe), min(self.conf.PROBE_WORKERS, len(to_probe))
+            ))
+            with ThreadPoolExecutor(max_workers=min(self.conf.PROBE_WORKERS, len(to_probe))) as executor:
+                futures = [(source, executor.submit(self._get_timed_source_info, source)) for source in to_probe]
+                for (source, future) in futures:
+                    try:
+                        result[source] = future.result()
+                    except FrameInputException as e:
+                        result[source] = e
+                    else:
+                        cache.put(source, result[source])
+            try:
+                cache.save()
+            except OSError as e:
+                self._warning('Failed to save probe cache: {}.'.format(str(e)))
+        return result
 
 
 if __name__ == '__main__':
@@ -446,12 +2633,50 @@ if __name__ == '__main__':
     )
     subparsers = parser.add_subparsers(dest='command', help='command help')
     parser_checkconf = subparsers.add_parser('confcheck', help='check configuration and exit')
+    parser_checkconf.add_argument(
+        '-l', '--layout',
+        help='path to layout file to check as well',
+    )
     parser_run = subparsers.add_parser('run', help='run')
     parser_run.add_argument(
         '-l', '--layout',
         help='path to layout file',
+    )
+    parser_run.add_argument(
+        '--mosaic',
+        help='compose the whole layout in a single ffmpeg process',
+        action='store_true',
+    )
+    parser_run_cluster = parser_run.add_mutually_exclusive_group()
+    parser_run_cluster.add_argument(
+        '--shard',
+        help='run the K-th of N equal-cost shards of the layout (every shard runs with the same layout)',
+        type=parse_shard,
+        metavar='K/N',
+    )
+    parser_run_cluster.add_argument(
+        '--coordinator',
+        help='run the frames the coordinator at this address assigns (no layout needed)',
+        type=parse_address,
+        metavar='HOST:PORT',
+    )
+    parser_run.add_argument(
+        '--node',
+        help='node name, unique per coordinator (host name and pid by default)',
+    )
+    parser_coordinate = subparsers.add_parser('coordinate', help='split the layout between worker nodes')
+    parser_coordinate.add_argument(
+        '-l', '--layout',
+        help='path to layout file',
         required=True,
     )
+    parser_coordinate.add_argument(
+        '--listen',
+        help='address to accept worker connections on (default: %(default)s)',
+        type=parse_address,
+        default='127.0.0.1:{}'.format(DEFAULT_CLUSTER_PORT),
+        metavar='HOST:PORT',
+    )
 
     app = Application(AppConfiguration, parser.parse_args())
     app.exec()
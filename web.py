@@ -1,12 +1,647 @@
-from bottle import route, run, static_file
+import glob
+import gzip
+import hashlib
+import json
+import math
+import mimetypes
+import os
+import stat
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from email.utils import formatdate
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, make_server
+
+from bottle import HTTPResponse, ServerAdapter, abort, request, response, route, run, static_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 from config import AppConfiguration
+from monitor import ALARM_STATE_REFRESH_INTERVAL, METRICS_HELP, EburStatsSegment, LoudnessHistory, apply_conf_defaults
+
+apply_conf_defaults(AppConfiguration)
+
+# segments are re-validated against the filesystem at most once per interval, reads go to the mapping only
+EBUR_SEGMENT_CHECK_INTERVAL = 1
+_ebur_segments = {}  # (path template, source id) -> {segment or history, inode, last check time, users, retired}
+_ebur_segments_lock = threading.Lock()
+EBUR_PUSH_INTERVAL = 0.1
+EBUR_PUSH_KEEPALIVE = 15
+EBUR_HISTORY_MAX_POINTS = 10000
+# the latest thumbnail of every source is kept in memory and re-read only when the supervisor replaced the file
+_thumbnails = {}  # source id -> (image, ETag, (inode, mtime), last check time)
+_thumbnails_lock = threading.Lock()
+STATIC_CHECK_INTERVAL = 1
+STATIC_MAX_CACHED_SIZE = 8 * 1024 * 1024  # larger files are served from disk
+STATIC_MIN_COMPRESSED_SIZE = 256
+# files without a precompressed .br sibling are compressed on first request, the default quality 11 takes seconds
+STATIC_BROTLI_QUALITY = 9
+# the alarm state and metrics copies of other nodes are ignored once they have not been rewritten for as many periods:
+# node names default to host name and pid, so every node that died leaves its own files behind
+NODE_FILE_MAX_PERIODS = 3
+
+
+@contextmanager
+def _use_mapping(path_tpl, opener, source_id):
+    # Yields the mapped segment or history of a source (None if there is none) for the duration of the block. A mapping
+    # replaced by a newer file or gone while blocks still read it is closed by the last of them to leave.
+    path = path_tpl.format(source_id)
+    key = (path_tpl, source_id)
+    now = time.time()
+    with _ebur_segments_lock:
+        entry = _ebur_segments.get(key)
+        if entry is None or not entry['segment'].live or now - entry['checked'] >= EBUR_SEGMENT_CHECK_INTERVAL:
+            try:
+                current_inode = os.stat(path).st_ino
+            except OSError:
+                current_inode = None
+            if entry is not None and (not entry['segment'].live or current_inode != entry['inode']):
+                _ebur_segments.pop(key)
+                entry['retired'] = True
+                if not entry['users']:
+                    entry['segment'].close()
+                entry = None
+            if entry is None and current_inode is not None:
+                try:
+                    entry = {'segment': opener(path), 'inode': current_inode, 'users': 0, 'retired': False}
+                except (OSError, ValueError):
+                    entry = None
+                else:
+                    _ebur_segments[key] = entry
+            if entry is not None:
+                entry['checked'] = now
+        if entry is not None:
+            entry['users'] += 1
+    try:
+        yield entry['segment'] if entry is not None else None
+    finally:
+        if entry is not None:
+            with _ebur_segments_lock:
+                entry['users'] -= 1
+                if entry['retired'] and not entry['users']:
+                    entry['segment'].close()
+
+
+def _use_ebur_segment(source_id):
+    return _use_mapping(AppConfiguration.EBUR_STATS_SHM_TPL, EburStatsSegment.open, source_id)
+
+
+def _use_ebur_history(source_id):
+    if AppConfiguration.EBUR_HISTORY_SHM_TPL is None:
+        return nullcontext()
+    return _use_mapping(AppConfiguration.EBUR_HISTORY_SHM_TPL, LoudnessHistory.open, source_id)
+
+
+def _json_float(v):
+    return v if math.isfinite(v) else None
+
+
+def _load_node_files(path, max_age):
+    # [(node name or None, document)] of the JSON file at path and of its copies written by the nodes sharing the
+    # host (path suffixed with ".<node name>", see monitor.py run --node), raises OSError or ValueError if one exists
+    # but is not readable. Copies whose document time is more than max_age seconds old are skipped.
+    documents = []
+    now = time.time()
+    for node_path in [path] + sorted(glob.glob(glob.escape(path) + '.*')):
+        if node_path.endswith('.tmp'):
+            continue
+        try:
+            with open(node_path) as fin:
+                document = json.load(fin)
+        except FileNotFoundError:
+            continue
+        node = node_path[len(path) + 1:] or None
+        if node is not None and now - document['time'] > max_age:
+            continue
+        documents.append((node, document))
+    return documents
+
+
+def _get_node_files_stat(path, max_age):
+    # changes whenever one of the files _load_node_files reads is written, added, removed or skipped as too old
+    current = []
+    now = time.time()
+    for node_path in [path] + sorted(glob.glob(glob.escape(path) + '.*')):
+        try:
+            st = os.stat(node_path)
+        except OSError:
+            continue
+        if node_path != path and now - st.st_mtime > max_age:
+            continue
+        current.append((node_path, st.st_ino, st.st_mtime_ns))
+    return tuple(current)
+
+
+def _get_alarms_max_age():
+    return NODE_FILE_MAX_PERIODS * max(AppConfiguration.ALARM_INTERVAL, ALARM_STATE_REFRESH_INTERVAL)
+
+
+def _load_alarms():
+    # returns (time of the latest state or None, raised alarms of every node), see _load_node_files
+    latest = None
+    alarms = []
+    for (node, state) in _load_node_files(AppConfiguration.ALARM_STATE_PATH, _get_alarms_max_age()):
+        latest = max(latest or 0, state['time'])
+        alarms += [dict(a, node=node) if node is not None else a for a in state['alarms']]
+    return latest, alarms
+
+
+class EburState:
+    # Single in-process view of every source's EBUR stats. One thread reads all segments every interval and
+    # versions each channel's last change; push clients ask for the delta since the version they last sent, and
+    # encoded deltas are shared between clients that are in step. The alarms written by the supervisor are versioned
+    # the same way and sent in full whenever they change.
+    DISCOVERY_INTERVAL = 1
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.version = 0
+        self._values = {}  # (source id, channel id) -> (changed at version, seq, payload or None if gone)
+        self._sources = set()
+        self._cond = threading.Condition()
+        self._delta_cache = {}  # (since, version) -> encoded delta
+        self._alarms = (0, [])  # (changed at version, raised alarms)
+        self._alarms_stat = None
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ebur-state', daemon=True)
+                self._thread.start()
+
+    def _discover(self):
+        prefix, _, suffix = AppConfiguration.EBUR_STATS_SHM_TPL.partition('{}')
+        sources = set()
+        for path in glob.glob(glob.escape(prefix) + '*' + glob.escape(suffix)):
+            source_id = path[len(prefix):len(path) - len(suffix)]
+            if source_id.isdigit():
+                sources.add(int(source_id))
+        return sources
+
+    def _read_alarms(self):
+        # returns the raised alarms if the alarm state of a node changed since the last call, otherwise None
+        if AppConfiguration.ALARM_STATE_PATH is None:
+            return None
+        current = _get_node_files_stat(AppConfiguration.ALARM_STATE_PATH, _get_alarms_max_age())
+        if current == self._alarms_stat:
+            return None
+        self._alarms_stat = current
+        try:
+            return _load_alarms()[1]
+        except (OSError, ValueError, KeyError, TypeError):
+            self._alarms_stat = None
+            return None
+
+    def _run(self):
+        last_discovery = 0
+        while True:
+            now = time.time()
+            try:
+                if now - last_discovery >= self.DISCOVERY_INTERVAL:
+                    self._sources = self._discover()
+                    last_discovery = now
+                self._update()
+            except Exception as e:
+                sys.stderr.write('<WARNING> EBUR state update failed: {}\n'.format(str(e) or type(e).__name__))
+            time.sleep(max(0, now + self.interval - time.time()))
+
+    def _update(self):
+        current = {}
+        for source_id in self._sources:
+            with _use_ebur_segment(source_id) as segment:
+                if segment is None or not segment.live:
+                    continue
+                for (ch_id, record) in zip(segment.channel_ids, segment.snapshot()):
+                    if record is not None:
+                        current[(source_id, ch_id)] = record
+        with self._cond:
+            version = self.version + 1
+            changed = False
+            for (key, record) in current.items():
+                previous = self._values.get(key)
+                if previous is None or previous[1] != record[0] or previous[2] is None:
+                    seq, timestamp, m, s, i, lra = record
+                    self._values[key] = (version, seq, {
+                        't': _json_float(timestamp), 'M': _json_float(m), 'S': _json_float(s),
+                        'I': _json_float(i), 'LRA': _json_float(lra),
+                    })
+                    changed = True
+            for (key, (_, seq, payload)) in list(self._values.items()):
+                if key not in current and payload is not None:
+                    self._values[key] = (version, seq, None)
+                    changed = True
+            alarms = self._read_alarms()
+            if alarms is not None and alarms != self._alarms[1]:
+                self._alarms = (version, alarms)
+                changed = True
+            if changed:
+                self.version = version
+                self._delta_cache = {}
+                self._cond.notify_all()
+
+    def wait(self, since, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self.version > since, timeout)
+            return self.version
+
+    def delta(self, since):
+        # returns (version, encoded {"version": ..., "sources": {source: {channel: values or null}}, "alarms": [...]}),
+        # alarms are only included if they changed
+        with self._cond:
+            key = (since, self.version)
+            encoded = self._delta_cache.get(key)
+            if encoded is None:
+                sources = {}
+                for ((source_id, ch_id), (changed, _, payload)) in self._values.items():
+                    if changed > since and (payload is not None or since > 0):
+                        sources.setdefault(str(source_id), {})[ch_id] = payload
+                delta = {'version': self.version, 'sources': sources}
+                if self._alarms[0] > since:
+                    delta['alarms'] = self._alarms[1]
+                encoded = json.dumps(delta, separators=(',', ':'))
+                self._delta_cache[key] = encoded
+            return self.version, encoded
+
+
+ebur_state = EburState(EBUR_PUSH_INTERVAL)
+
+
+class ThreadingWSGIRefServer(ServerAdapter):
+    # bottle's default wsgiref server handles one request at a time, which a streaming endpoint would block
+
+    def run(self, app):
+        class _Server(ThreadingMixIn, WSGIServer):
+            daemon_threads = True
+
+        make_server(self.host, self.port, app, _Server).serve_forever()
+
+
+class StaticCache:
+    # Files of a directory held in memory, loaded on first request and re-validated against the filesystem at most
+    # once per interval. Every file is kept with its gzip and brotli (if the module is installed) variants:
+    # precompressed siblings (style.css.gz, style.css.br) are taken as they are, other compressible files are
+    # compressed once when loaded. Each variant carries a strong ETag hashed from its content. Files are loaded and
+    # compressed outside the lock, so a large file does not hold up requests for the others; requests racing for the
+    # same file may load it twice, the first one to finish is kept.
+    ENCODINGS = ('br', 'gzip')  # in order of preference
+    SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+    COMPRESSIBLE_TYPES = ('application/javascript', 'application/json', 'image/svg+xml')
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self._entries = {}  # path -> entry
+        self._lock = threading.Lock()
+
+    def get(self, filepath):
+        # returns the entry of a file under root, None if it is missing or not cached (see STATIC_MAX_CACHED_SIZE)
+        path = os.path.realpath(os.path.join(self.root, filepath))
+        if not path.startswith(self.root + os.sep):
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and now - entry['checked'] < STATIC_CHECK_INTERVAL:
+                return entry
+        try:
+            version = self._get_version(path)
+            if version is not None and (entry is None or entry['version'] != version):
+                entry = self._load(path, version)
+        except OSError:
+            version = None
+        with self._lock:
+            if version is None:
+                self._entries.pop(path, None)
+                return None
+            current = self._entries.get(path)
+            if current is not None and current['version'] == version:
+                entry = current
+            entry['checked'] = now
+            self._entries[path] = entry
+            return entry
+
+    def _get_version(self, path):
+        # (mtime, size, inode) of the file and of its precompressed siblings, None if the file is not cacheable
+        st = os.stat(path)
+        if not stat.S_ISREG(st.st_mode) or st.st_size > STATIC_MAX_CACHED_SIZE:
+            return None
+        version = [(st.st_mtime_ns, st.st_size, st.st_ino)]
+        for suffix in self.SUFFIXES.values():
+            try:
+                sibling = os.stat(path + suffix)
+            except FileNotFoundError:
+                version.append(None)
+            else:
+                version.append((sibling.st_mtime_ns, sibling.st_size, sibling.st_ino))
+        return version
+
+    def _load(self, path, version):
+        with open(path, 'rb') as fin:
+            data = fin.read()
+        content_type, _ = mimetypes.guess_type(path)
+        if content_type is None:
+            content_type = 'application/octet-stream'
+        compressible = content_type.startswith('text/') or content_type in self.COMPRESSIBLE_TYPES
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=UTF-8'
+        variants = {None: data}
+        for encoding in self.ENCODINGS:
+            try:
+                with open(path + self.SUFFIXES[encoding], 'rb') as fin:
+                    body = fin.read()
+            except FileNotFoundError:
+                body = None
+                if compressible and len(data) >= STATIC_MIN_COMPRESSED_SIZE:
+                    if encoding == 'gzip':
+                        body = gzip.compress(data, mtime=0)
+                    elif brotli is not None:
+                        body = brotli.compress(data, quality=STATIC_BROTLI_QUALITY)
+            if body is not None and len(body) < len(data):
+                variants[encoding] = body
+        return {
+            'version': version,
+            'checked': 0,
+            'content_type': content_type,
+            'last_modified': formatdate(version[0][0] / 1e9, usegmt=True),
+            'variants': {e: (body, '"{}"'.format(hashlib.sha256(body).hexdigest()[:32]))
+                         for (e, body) in variants.items()},  # encoding (None for identity) -> (body, ETag)
+        }
+
+
+_static_cache = StaticCache(AppConfiguration.STATIC_DIR)
+
+
+def _get_accepted_encodings(header):
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _etag_matches(etag):
+    return etag in (t.strip() for t in request.headers.get('If-None-Match', '').split(','))
 
 
 @route('/static/<filepath:path>')
 def server_static(filepath):
-    static_file(filepath, AppConfiguration.STATIC_DIR)
+    if AppConfiguration.WEB_DEBUG:
+        return static_file(filepath, AppConfiguration.STATIC_DIR)
+    entry = _static_cache.get(filepath)
+    if entry is None:
+        # missing or too large to be held in memory, bottle answers from the disk
+        return static_file(filepath, AppConfiguration.STATIC_DIR)
+    accepted = _get_accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    encoding = next((e for e in StaticCache.ENCODINGS if e in entry['variants'] and e in accepted), None)
+    body, etag = entry['variants'][encoding]
+    headers = {
+        'ETag': etag, 'Cache-Control': 'public, max-age={}'.format(AppConfiguration.STATIC_MAX_AGE),
+        'Last-Modified': entry['last_modified'],
+        'Vary': 'Accept-Encoding',
+    }
+    if _etag_matches(etag):
+        return HTTPResponse(status=304, headers=headers)
+    headers['Content-Type'] = entry['content_type']
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+    return HTTPResponse(body, headers=headers)
+
+
+@route('/api/ebur/<source_id:int>')
+def ebur_stats(source_id):
+    with _use_ebur_segment(source_id) as segment:
+        if segment is None:
+            abort(404, 'No EBUR stats for source {}.'.format(source_id))
+        channels = []
+        for (ch_id, record) in zip(segment.channel_ids, segment.snapshot()):
+            if record is None:
+                continue
+            seq, timestamp, m, s, i, lra = record
+            channels.append({
+                'channel': ch_id, 'seq': seq, 'time': _json_float(timestamp),
+                'M': _json_float(m), 'S': _json_float(s), 'I': _json_float(i), 'LRA': _json_float(lra),
+            })
+        return {'source': source_id, 'live': segment.live, 'channels': channels}
+
+
+@route('/api/ebur/<source_id:int>/history')
+def ebur_history(source_id):
+    # "channel" (channel id) is required, "minutes" (10 by default) and "resolution" (seconds, the finest one
+    # covering the period by default) select the period and its buckets
+    with _use_ebur_history(source_id) as history:
+        if history is None:
+            abort(404, 'No EBUR history for source {}.'.format(source_id))
+        try:
+            ch = history.channel_ids.index(request.query.get('channel'))
+        except ValueError:
+            abort(404, 'No such channel.')
+        try:
+            minutes = float(request.query.get('minutes', 10))
+            resolution = request.query.get('resolution')
+            resolution = float(resolution) if resolution is not None else None
+        except ValueError:
+            abort(400, 'Invalid minutes or resolution.')
+        if not math.isfinite(minutes) or minutes <= 0 or \
+                (resolution is not None and (not math.isfinite(resolution) or resolution <= 0)):
+            abort(400, 'Invalid minutes or resolution.')
+        if resolution is not None and minutes * 60 / resolution > EBUR_HISTORY_MAX_POINTS:
+            abort(400, 'Too many points requested.')
+        result = history.query(ch, minutes * 60, resolution)
+        if result is None:
+            abort(503, 'EBUR history is being written, retry later.')
+        # buckets are stored as float32, more digits would only be noise
+        result['t'] = [round(v, 3) for v in result['t']]
+        for field in LoudnessHistory.FIELDS:
+            result[field] = [_json_float(round(v, 2)) for v in result[field]]
+        result.update({'source': source_id, 'channel': history.channel_ids[ch], 'live': history.live})
+        return result
+
+
+def _get_thumbnail(source_id):
+    # returns (image, ETag) or None, same check interval as the segments
+    path = AppConfiguration.THUMBNAIL_SHM_TPL.format(source_id)
+    now = time.time()
+    with _thumbnails_lock:
+        image, etag, version, checked = _thumbnails.get(source_id, (None, None, None, 0))
+        if image is not None and now - checked < EBUR_SEGMENT_CHECK_INTERVAL:
+            return image, etag
+        try:
+            st = os.stat(path)
+        except OSError:
+            _thumbnails.pop(source_id, None)
+            return None
+        if (st.st_ino, st.st_mtime_ns) != version:
+            try:
+                with open(path, 'rb') as fin:
+                    image = fin.read()
+            except OSError:
+                _thumbnails.pop(source_id, None)
+                return None
+            etag = '"{}"'.format(hashlib.sha1(image).hexdigest())
+        _thumbnails[source_id] = (image, etag, (st.st_ino, st.st_mtime_ns), now)
+        return image, etag
+
+
+@route('/api/thumbnail/<source_id:int>')
+def thumbnail(source_id):
+    if AppConfiguration.THUMBNAIL_SHM_TPL is None:
+        abort(404, 'Thumbnails are disabled.')
+    found = _get_thumbnail(source_id)
+    if found is None:
+        abort(404, 'No thumbnail for source {} yet.'.format(source_id))
+    image, etag = found
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if _etag_matches(etag):
+        return HTTPResponse(status=304, headers=headers)
+    headers['Content-Type'] = 'image/jpeg'
+    return HTTPResponse(image, headers=headers)
+
+
+@route('/api/alarms')
+def alarms():
+    if AppConfiguration.ALARM_STATE_PATH is None:
+        abort(404, 'Alarms are disabled.')
+    try:
+        latest, raised = _load_alarms()
+    except (OSError, ValueError, KeyError, TypeError):
+        abort(503, 'Alarm state is not readable, retry later.')
+    return {'time': latest, 'alarms': raised}
+
+
+@route('/api/cluster')
+def cluster():
+    # the coordinator's view of the whole wall, see cluster.Coordinator
+    if AppConfiguration.CLUSTER_STATE_PATH is None:
+        abort(404, 'Cluster state is disabled.')
+    try:
+        with open(AppConfiguration.CLUSTER_STATE_PATH) as fin:
+            return json.load(fin)
+    except FileNotFoundError:
+        abort(404, 'No coordinator is running.')
+    except (OSError, ValueError):
+        abort(503, 'Cluster state is not readable, retry later.')
+
+
+def _get_proc_stats(pid):
+    # returns (CPU seconds, resident bytes) of a local process or None if it is gone
+    try:
+        with open('/proc/{}/stat'.format(pid)) as fin:
+            # the command name may contain spaces, the fields after it are fixed
+            fields = fin.read().rpartition(')')[2].split()
+    except OSError:
+        return None
+    try:
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        return cpu, int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    except (IndexError, ValueError):
+        return None
+
+
+def _format_metric_line(name, labels, value):
+    if labels:
+        name = '{}{{{}}}'.format(name, ','.join('{}="{}"'.format(
+            k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        ) for (k, v) in sorted(labels.items())))
+    return '{} {}'.format(name, repr(float(value)))
+
+
+@route('/metrics')
+def metrics():
+    # Prometheus text exposition of the supervisor snapshots (one per node sharing the host, labelled with the node
+    # name), CPU and memory of their ffmpeg processes are read from /proc at scrape time
+    if AppConfiguration.METRICS_PATH is None:
+        abort(404, 'Metrics are disabled.')
+    try:
+        snapshots = _load_node_files(
+            AppConfiguration.METRICS_PATH, NODE_FILE_MAX_PERIODS * AppConfiguration.METRICS_INTERVAL
+        )
+    except (OSError, ValueError, KeyError, TypeError):
+        abort(503, 'Metrics are not readable, retry later.')
+    if not snapshots:
+        abort(503, 'The monitor is not running.')
+    values = []
+    for (node, snapshot) in snapshots:
+        node_labels = {'node': node} if node is not None else {}
+        values += [dict(v, labels=dict(v['labels'], **node_labels)) for v in snapshot['metrics']]
+        for p in snapshot['processes']:
+            stats = _get_proc_stats(p['pid']) if p['pid'] is not None else None
+            if stats is not None:
+                labels = dict(node_labels, process=p['name'])
+                values.append({'name': 'monitor_ffmpeg_cpu_seconds_total', 'labels': labels, 'value': stats[0]})
+                values.append({'name': 'monitor_ffmpeg_resident_memory_bytes', 'labels': labels, 'value': stats[1]})
+        values.append({
+            'name': 'monitor_metrics_age_seconds', 'labels': node_labels, 'value': time.time() - snapshot['time']
+        })
+    by_name = {}
+    for v in values:
+        by_name.setdefault(v['name'], []).append(v)
+    lines = []
+    for (name, (metric_type, help_text, buckets)) in METRICS_HELP.items():
+        if name not in by_name:
+            continue
+        lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} {}'.format(name, metric_type)]
+        for v in by_name[name]:
+            if metric_type != 'histogram':
+                lines.append(_format_metric_line(name, v['labels'], v['value']))
+                continue
+            cumulative = 0
+            for (le, count) in zip(list(buckets) + [math.inf], v['value']['counts']):
+                cumulative += count
+                lines.append(_format_metric_line(
+                    '{}_bucket'.format(name), dict(v['labels'], le=repr(float(le)) if le != math.inf else '+Inf'),
+                    cumulative
+                ))
+            lines.append(_format_metric_line('{}_sum'.format(name), v['labels'], v['value']['sum']))
+            lines.append(_format_metric_line('{}_count'.format(name), v['labels'], v['value']['count']))
+    response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    return '\n'.join(lines) + '\n'
+
+
+@route('/api/ebur/stream')
+def ebur_stream():
+    # Server-sent events: the first event carries every known value, the following ones only the values changed
+    # since the previous event. "rate" (events per second) lowers the update rate for a client.
+    try:
+        rate = float(request.query.get('rate', 1 / EBUR_PUSH_INTERVAL))
+    except ValueError:
+        abort(400, 'Invalid rate.')
+    if not math.isfinite(rate) or rate <= 0:
+        abort(400, 'Invalid rate.')
+    client_interval = max(EBUR_PUSH_INTERVAL, 1 / rate)
+    ebur_state.start()
+    response.content_type = 'text/event-stream'
+    response.set_header('Cache-Control', 'no-cache')
+    response.set_header('X-Accel-Buffering', 'no')
+
+    def _events():
+        since = 0
+        last_sent = time.time()
+        while True:
+            started = time.time()
+            if ebur_state.wait(since, EBUR_PUSH_KEEPALIVE) > since:
+                since, encoded = ebur_state.delta(since)
+                yield 'event: ebur\ndata: {}\n\n'.format(encoded)
+                last_sent = time.time()
+            elif time.time() - last_sent >= EBUR_PUSH_KEEPALIVE:
+                yield ': keepalive\n\n'
+                last_sent = time.time()
+            time.sleep(max(0, started + client_interval - time.time()))
+
+    return _events()
 
 
 if __name__ == '__main__':
-    run(host='localhost', port=8080, debug=True)
+    run(host=AppConfiguration.WEB_HOST, port=AppConfiguration.WEB_PORT, debug=AppConfiguration.WEB_DEBUG,
+        server=ThreadingWSGIRefServer)